@@ -0,0 +1,109 @@
+"""
+acoustic_features.py: Vectorized acoustic summary of a recorded segment.
+
+All features come from one NumPy pass over the int16 buffer: the signal is
+cut into Hann-windowed frames, transformed with a single batched rFFT and
+reduced to
+
+    rms_dbfs, peak_dbfs      overall level
+    band_energy              fraction of spectral power in each band
+    spectral_centroid_hz     power-weighted mean frequency
+    aci                      acoustic complexity index (frame-to-frame
+                             spectral change, normalized per bin)
+    activity                 fraction of frames more than ACTIVITY_DB above
+                             the segment's median frame level (noise floor)
+
+activity measures transients against the segment's own background, so a
+steady sound (a chorus, insects, rain) scores near 0, the same as silence.
+is_silent() therefore also requires the overall level to be below an
+absolute floor before a segment counts as silent.
+
+Usage from the command line:
+    python3 acoustic_features.py /home/pi/data/audio/recording_....wav
+
+Author: BEAM Project
+"""
+
+import json
+import sys
+import wave
+
+try:
+    import numpy as np
+except ImportError:  # features are optional; callers check HAVE_NUMPY
+    np = None
+
+HAVE_NUMPY = np is not None
+
+DEFAULT_BANDS = [[0, 500], [500, 2000], [2000, 8000], [8000, 24000]]
+FRAME = 1024
+ACTIVITY_DB = 6.0
+SILENCE_FLOOR_DBFS = -50.0
+EPS = 1e-12
+
+
+def compute_features(samples, rate, channels=1, bands=DEFAULT_BANDS, frame=FRAME):
+    """Summarize an int16 sample buffer (interleaved if channels > 1)."""
+    x = np.asarray(samples, dtype=np.int16).astype(np.float32) / 32768.0
+    if channels > 1:
+        x = x[: len(x) - len(x) % channels].reshape(-1, channels).mean(axis=1)
+    if len(x) < frame:
+        x = np.pad(x, (0, frame - len(x)))
+
+    rms = float(np.sqrt(np.mean(x * x)))
+    peak = float(np.max(np.abs(x)))
+
+    n_frames = len(x) // frame
+    frames = x[: n_frames * frame].reshape(n_frames, frame) * np.hanning(frame).astype(np.float32)
+    mag = np.abs(np.fft.rfft(frames, axis=1))           # (n_frames, bins)
+    power = mag * mag
+    freqs = np.fft.rfftfreq(frame, 1.0 / rate)
+
+    bin_power = power.sum(axis=0)
+    total = float(bin_power.sum()) + EPS
+    band_energy = {
+        f"{lo}-{hi}": round(float(bin_power[(freqs >= lo) & (freqs < hi)].sum()) / total, 4)
+        for lo, hi in bands
+    }
+    centroid = float((freqs * bin_power).sum()) / total
+
+    # ACI: per-bin sum of |frame-to-frame change| over the bin's total magnitude
+    if n_frames > 1:
+        aci = float((np.abs(np.diff(mag, axis=0)).sum(axis=0) / (mag.sum(axis=0) + EPS)).sum())
+    else:
+        aci = 0.0
+
+    frame_db = 10.0 * np.log10(power.mean(axis=1) + EPS)
+    activity = float(np.mean(frame_db > np.median(frame_db) + ACTIVITY_DB))
+
+    return {
+        "rms_dbfs": round(float(20.0 * np.log10(rms + EPS)), 2),
+        "peak_dbfs": round(float(20.0 * np.log10(peak + EPS)), 2),
+        "band_energy": band_energy,
+        "spectral_centroid_hz": round(centroid, 1),
+        "aci": round(aci, 3),
+        "activity": round(activity, 4),
+    }
+
+
+def is_silent(features, threshold, floor_dbfs=SILENCE_FLOOR_DBFS):
+    """True if a segment has too few transients (activity < threshold) and is quiet overall (rms below floor_dbfs)."""
+    return features["activity"] < threshold and features["rms_dbfs"] < floor_dbfs
+
+
+def analyze_wav(wav_path, bands=DEFAULT_BANDS, frame=FRAME):
+    """Read an int16 WAV into one buffer and return compute_features() for it."""
+    if not HAVE_NUMPY:
+        raise ImportError("numpy is required for acoustic features (sudo apt install python3-numpy)")
+    with wave.open(wav_path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{wav_path}: only int16 WAVs are supported")
+        rate = wf.getframerate()
+        channels = wf.getnchannels()
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype="<i2")
+    return compute_features(samples, rate, channels, bands, frame)
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        print(json.dumps({"file": path, **analyze_wav(path)}, indent=2))
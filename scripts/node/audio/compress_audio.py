@@ -0,0 +1,157 @@
+"""
+compress_audio.py: Lossless FLAC compression stage for recorded segments.
+
+Closed WAV files are handed to a CompressionWorker, a single background
+thread that runs the `flac` encoder (apt package "flac", works offline) at
+the lowest CPU and I/O priority so it never competes with capture. Each
+FLAC file is decoded again and its PCM compared against the WAV's before
+the WAV is deleted; on any mismatch or error the WAV is kept untouched.
+
+Enable with "compress": "flac" in the audio block of config.json
+("flac_level" 0-8, default 5).
+
+Usage from the command line:
+    python3 compress_audio.py /home/pi/data/audio/recording_....wav
+
+Author: BEAM Project
+"""
+
+import hashlib
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import wave
+
+FLAC_BIN = shutil.which("flac")
+# Run the encoder as an idle-priority job (nice 19, idle I/O class)
+LOW_PRIORITY = (["nice", "-n", "19"] + (["ionice", "-c", "3"] if shutil.which("ionice") else []))
+
+
+class CompressionError(RuntimeError):
+    """Raised when a segment could not be compressed and verified."""
+
+
+def available():
+    return FLAC_BIN is not None
+
+
+def wav_pcm_digest(wav_path, block_frames=65536):
+    """SHA-1 of the WAV's sample data, read in blocks."""
+    digest = hashlib.sha1()
+    with wave.open(wav_path, "rb") as wf:
+        while True:
+            data = wf.readframes(block_frames)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def flac_pcm_digest(flac_path):
+    """SHA-1 of the raw PCM obtained by decoding flac_path."""
+    digest = hashlib.sha1()
+    proc = subprocess.Popen(LOW_PRIORITY + [FLAC_BIN, "-d", "-s", "-c", "--force-raw-format",
+                                            "--endian=little", "--sign=signed", flac_path],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    for block in iter(lambda: proc.stdout.read(65536), b""):
+        digest.update(block)
+    if proc.wait() != 0:
+        raise CompressionError(f"flac decode failed for {flac_path}")
+    return digest.hexdigest()
+
+
+def compress_to_flac(wav_path, level=5):
+    """
+    Encode wav_path to FLAC, verify by round-trip decode and delete the WAV.
+    Returns metadata for the record: file, codec, byte sizes and ratio.
+    """
+    if not available():
+        raise CompressionError("flac encoder not installed (sudo apt install flac)")
+
+    flac_path = os.path.splitext(wav_path)[0] + ".flac"
+    tmp_path = flac_path + ".part"
+    result = subprocess.run(LOW_PRIORITY + [FLAC_BIN, f"-{level}", "-s", "-f", "-o", tmp_path, wav_path],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        _remove(tmp_path)
+        raise CompressionError(f"flac encode failed for {wav_path}: {result.stderr.strip()}")
+
+    try:
+        if flac_pcm_digest(tmp_path) != wav_pcm_digest(wav_path):
+            raise CompressionError(f"round-trip mismatch for {wav_path}")
+    except Exception:
+        _remove(tmp_path)
+        raise
+
+    wav_bytes = os.path.getsize(wav_path)
+    os.replace(tmp_path, flac_path)
+    flac_bytes = os.path.getsize(flac_path)
+    os.remove(wav_path)
+    return {
+        "file": flac_path,
+        "codec": "flac",
+        "wav_bytes": wav_bytes,
+        "flac_bytes": flac_bytes,
+        "compression_ratio": round(wav_bytes / flac_bytes, 3) if flac_bytes else None,
+    }
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class CompressionWorker:
+    """
+    Background thread that compresses queued WAV files one at a time.
+
+    submit(wav_path, on_done) queues a file; on_done(info) is called from the
+    worker thread with the metadata from compress_to_flac(), or with None if
+    compression failed and the WAV was kept.
+    """
+
+    def __init__(self, level=5, log=print):
+        self.level = level
+        self.log = log
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="flac-worker", daemon=True)
+        self.thread.start()
+
+    def submit(self, wav_path, on_done):
+        self.jobs.put((wav_path, on_done))
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            wav_path, on_done = job
+            try:
+                info = compress_to_flac(wav_path, self.level)
+                self.log(f"[BEAM] Compressed {os.path.basename(wav_path)} -> "
+                         f"{os.path.basename(info['file'])} (ratio {info['compression_ratio']})")
+            except Exception as e:
+                self.log(f"[BEAM] WARNING: keeping WAV, compression failed: {e}")
+                info = None
+            try:
+                on_done(info)
+            except Exception as e:
+                self.log(f"[BEAM] ERROR: compression callback failed: {e}")
+
+    def close(self):
+        """Finish every queued file, then stop the worker."""
+        self.jobs.put(None)
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: compress_audio.py <file.wav> [...]")
+        raise SystemExit(2)
+    for path in sys.argv[1:]:
+        print(compress_to_flac(path))
@@ -0,0 +1,199 @@
+"""
+Continuous Audio Recorder for BEAM
+Author: BEAM Project
+
+Long-running companion to record_audio.py. PyAudio and the input stream are
+opened once and kept open; audio is written as a series of fixed-length
+segment files ("segment_sec") with no gap between them. Optional duty cycling
+("duty_on_sec" / "duty_off_sec", e.g. 10 s on, 50 s off) pauses the stream
+between bursts without reopening the device.
+
+Every closed segment is added to the directory's media index (see
+media_index.py, shared with record_audio.py) with its start time derived
+from the sample counter, so segment timestamps are sample-accurate relative
+to the start of each burst. With "ring_segments" > 0
+only the newest N finished segment files are kept on disk: a segment is
+evicted only once its index entry has been written (after compression and
+preview), and each eviction is recorded in the index as an update for the
+same file with "audio_dropped": "ring_evicted". With "compress": "flac"
+closed segments are converted to verified FLAC in the background, and with
+"features": true each entry carries an acoustic summary (see
+acoustic_features.py); quiet segments below "silence_threshold" (and
+"silence_floor_dbfs") keep only that.
+With "preview": "png" (or "npy") a small spectrogram of every kept segment
+is written to the shipping directory (see spectrogram_preview.py).
+
+Enable with "mode": "continuous" in the audio block of config.json (the
+scheduler then stops running per-reading clips) and run this script as a
+service (see continuous_audio.service).
+"""
+
+import os
+import sys
+import signal
+import time
+import wave
+from collections import deque
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import record_audio  # also installs the ALSA error handler
+from record_audio import pyaudio, write_chunks, make_previewer, SegmentFinisher
+from compress_audio import CompressionWorker
+
+import node_config
+from media_index import MediaIndex
+from record_log import segment_lock
+
+# -----------------------------
+# Load configuration
+# -----------------------------
+config = node_config.load()
+global_config = node_config.global_config()
+audio_config = config["audio"]
+
+base_dir = global_config.get("base_dir", os.path.join(record_audio.project_root, "data"))
+directory = os.path.join(base_dir, audio_config.get("directory", "audio"))
+os.makedirs(directory, exist_ok=True)
+
+RATE = audio_config.get("sample_rate", 48000)
+CHANNELS = audio_config.get("channels", 1)
+FORMAT = pyaudio.paInt16 if audio_config.get("format", "int16") == "int16" else pyaudio.paFloat32
+CHUNK = audio_config.get("chunk", 1024)
+SEGMENT_SEC = audio_config.get("segment_sec", 60)
+DUTY_ON_SEC = audio_config.get("duty_on_sec")        # None = record continuously
+DUTY_OFF_SEC = audio_config.get("duty_off_sec", 0)
+RING_SEGMENTS = audio_config.get("ring_segments", 0)  # 0 = keep every segment
+file_prefix = audio_config.get("file_prefix", "recording_")
+debug = global_config.get("print_debug", True)
+
+# -----------------------------
+# Shutdown handling
+# -----------------------------
+stopping = False
+
+def request_stop(signum, frame):
+    # Let the current segment end at the next chunk boundary and be indexed
+    global stopping
+    stopping = True
+
+signal.signal(signal.SIGTERM, request_stop)
+signal.signal(signal.SIGINT, request_stop)
+
+def sleep_unless_stopping(seconds):
+    end = time.monotonic() + seconds
+    while not stopping and time.monotonic() < end:
+        time.sleep(min(1.0, end - time.monotonic()))
+
+# -----------------------------
+# Recording loop
+# -----------------------------
+# Optional spectrogram previews, rendered in separate low-priority processes
+previewer = make_previewer(audio_config, global_config)
+
+audio = pyaudio.PyAudio()
+sample_width = audio.get_sample_size(FORMAT)
+chunk_bytes = CHUNK * CHANNELS * sample_width
+
+stream = audio.open(format=FORMAT, channels=CHANNELS,
+                    rate=RATE, input=True,
+                    frames_per_buffer=CHUNK)
+index = MediaIndex(directory, node_id=global_config.get("node_id"), sensor="audio",
+                   rollover_sec=global_config.get("rollover_sec", 3600))
+ring = deque()  # indexed segment entries still on disk, oldest first
+total_samples = 0
+
+def write_entry(entry):
+    """Index a finished segment, then evict the oldest finished ones beyond RING_SEGMENTS."""
+    index.add(entry)
+    if not RING_SEGMENTS or not entry.get("file"):
+        return  # culled segments have no file left
+    ring.append(entry)
+    while len(ring) > RING_SEGMENTS:
+        oldest = ring.popleft()
+        try:
+            with segment_lock(directory, exclusive=False):  # not while shipping.py moves files
+                os.remove(oldest["file"])
+        except FileNotFoundError:
+            continue  # already shipped
+        # Appended now; the segment's start time moves to captured_at
+        index.add(dict(oldest, timestamp=datetime.now(timezone.utc).isoformat(),
+                       captured_at=oldest["timestamp"], audio_dropped="ring_evicted"), checksum=False)
+
+# Optional lossless compression of closed segments in a low-priority thread;
+# the index entry is written once the FLAC has been verified
+compressor = None
+if audio_config.get("compress") == "flac":
+    compressor = CompressionWorker(level=audio_config.get("flac_level", 5))
+
+# Everything after the WAV is closed (features, preview, index entry) runs
+# on this thread, so the loop below only reads the stream and writes WAVs
+finisher = SegmentFinisher(audio_config, compressor, write_entry, previewer)
+
+if debug:
+    duty = f"{DUTY_ON_SEC}s on / {DUTY_OFF_SEC}s off" if DUTY_ON_SEC else "continuous"
+    print(f"[BEAM] Continuous recorder: {SEGMENT_SEC}s segments, {duty}, into {directory}")
+
+try:
+    while not stopping:
+        # Anchor the burst: segment start times are derived from the number
+        # of samples read since this point, not from the wall clock per file
+        burst_start = time.time() - stream.get_input_latency()
+        burst_samples = 0
+        on_remaining = DUTY_ON_SEC if DUTY_ON_SEC else float("inf")
+
+        while on_remaining > 0 and not stopping:
+            seg_sec = min(SEGMENT_SEC, on_remaining)
+            n_chunks = max(1, round(seg_sec * RATE / CHUNK))
+
+            start_ts = datetime.fromtimestamp(burst_start + burst_samples / RATE, timezone.utc)
+            wav_filename = os.path.join(directory, f"{file_prefix}{start_ts.isoformat()}.wav".replace(":", "-"))
+
+            with wave.open(wav_filename, 'wb') as wf:
+                wf.setnchannels(CHANNELS)
+                wf.setsampwidth(sample_width)
+                wf.setframerate(RATE)
+                chunks_written, overflows, underruns = write_chunks(
+                    stream, wf, n_chunks, CHUNK, chunk_bytes, stop=lambda: stopping)
+
+            frames = chunks_written * CHUNK
+            entry = {
+                "timestamp": start_ts.isoformat(),
+                "file": wav_filename,
+                "start_sample": total_samples,
+                "frames": frames,
+                "duration_sec": frames / RATE,
+                "sample_rate": RATE,
+                "channels": CHANNELS,
+                "format": "int16",
+                "overflows": overflows,
+                "underruns": underruns
+            }
+            finisher.submit(wav_filename, entry)
+            burst_samples += frames
+            total_samples += frames
+            on_remaining -= seg_sec
+
+            if overflows or underruns:
+                print(f"[BEAM] WARNING: {overflows} overflow(s), {underruns} underrun(s) in {wav_filename}")
+            if debug:
+                print(f"[BEAM] Segment closed: {wav_filename} ({frames / RATE:.2f}s)")
+
+        if DUTY_ON_SEC and not stopping:
+            # Pause capture but keep the device open for the next burst
+            stream.stop_stream()
+            sleep_unless_stopping(DUTY_OFF_SEC)
+            if not stopping:
+                stream.start_stream()
+finally:
+    if stream.is_active():
+        stream.stop_stream()
+    stream.close()
+    audio.terminate()
+    finisher.close()
+    if previewer is not None:
+        previewer.close()
+    if compressor is not None:
+        compressor.close()
+    if debug:
+        print("[BEAM] Continuous recorder stopped")
@@ -1,123 +1,332 @@
-import sys
-from pathlib import Path
-
-VENDOR_DIR = Path(__file__).resolve().parents[1] / "vendor"
-sys.path.insert(0, str(VENDOR_DIR))
-
-# record.py — Unified Audio Recorder for BEAM
-# Author: Raiz Mohammed / Jaidyn Edwards
-# Updated: 2025-10-20
-
-import os
-import json
-import time
-import wave
-import pyaudio
-from datetime import datetime, timezone
-import ctypes
-from ctypes.util import find_library
-
-# Suppress ALSA warnings (from PyAudio backend)
-try:
-    def py_error_handler(filename, line, function, err, fmt):
-        pass  # Do nothing (silence ALSA C errors)
-
-    c_error_handler = ctypes.CFUNCTYPE(
-        None,
-        ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p,
-        ctypes.c_int, ctypes.c_char_p
-    )(py_error_handler)
-
-    asound = ctypes.CDLL(find_library('asound'))
-    asound.snd_lib_error_set_handler(c_error_handler)
-except Exception:
-    pass
-
-# Determine project root dynamically
-project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
-
-# Load config
-config_path = "/home/pi/BEAMNode_Prototype1/scripts/node/config.json"
-with open(config_path, "r") as f:
-    config = json.load(f)
-
-audio_config = config["audio"]
-global_config = config["global"]
-
-# Base directory: /home/pi/data/audio
-base_dir = global_config.get("base_dir", os.path.join(project_root, "data"))
-directory = os.path.join(base_dir, audio_config.get("directory", "audio"))
-os.makedirs(directory, exist_ok=True)
-
-# File path setup
-timestamp = datetime.now(timezone.utc).isoformat()
-file_prefix = audio_config.get("file_prefix", "recording_")
-wav_filename = os.path.join(directory, f"{file_prefix}{timestamp}.wav")
-
-# Replace : with - in filename to avoid invalid characters
-wav_filename = wav_filename.replace(":", "-")
-
-# Recording parameters
-DURATION = audio_config.get("duration_sec", 10)
-RATE = audio_config.get("sample_rate", 48000)
-CHANNELS = audio_config.get("channels", 1)
-FORMAT = pyaudio.paInt16 if audio_config.get("format", "int16") == "int16" else pyaudio.paFloat32
-CHUNK = audio_config.get("chunk", 1024)
-
-# Initialize audio interface
-audio = pyaudio.PyAudio()
-stream = audio.open(format=FORMAT, channels=CHANNELS,
-                    rate=RATE, input=True,
-                    frames_per_buffer=CHUNK)
-
-if global_config.get("print_debug", True):
-    print(f"[BEAM] Recording {DURATION}s of audio to {wav_filename}")
-
-frames = []
-for _ in range(0, int(RATE / CHUNK * DURATION)):
-    data = stream.read(CHUNK, exception_on_overflow=False)
-    frames.append(data)
-
-stream.stop_stream()
-stream.close()
-audio.terminate()
-
-# Save .wav file
-with wave.open(wav_filename, 'wb') as wf:
-    wf.setnchannels(CHANNELS)
-    wf.setsampwidth(audio.get_sample_size(FORMAT))
-    wf.setframerate(RATE)
-    wf.writeframes(b''.join(frames))
-
-if global_config.get("print_debug", True):
-    print(f"[BEAM] Saved audio file: {wav_filename}")
-
-# Create MASTER.json in same directory
-master_json = os.path.join(directory, "MASTER.json")
-
-# New record entry
-record_entry = {
-    "timestamp": datetime.now(timezone.utc).isoformat(),
-    "file": wav_filename,
-    "duration_sec": DURATION,
-    "sample_rate": RATE,
-    "channels": CHANNELS,
-    "format": "int16"
-}
-
-# Append to MASTER.json
-if not os.path.exists(master_json):
-    with open(master_json, "w") as f:
-        json.dump({"node_id": global_config.get("node_id"), "sensor": "audio", "records": []}, f, indent=4)
-
-with open(master_json, "r+") as f:
-    log = json.load(f)
-    if "records" not in log:
-        log["records"] = []
-    log["records"].append(record_entry)
-    f.seek(0)
-    json.dump(log, f, indent=4)
-    f.truncate()
-
-if global_config.get("print_debug", True):
-    print(f"[BEAM] Logged record to {master_json}")
+import sys
+from pathlib import Path
+
+VENDOR_DIR = Path(__file__).resolve().parents[1] / "vendor"
+sys.path.insert(0, str(VENDOR_DIR))
+
+# record.py — Unified Audio Recorder for BEAM
+# Author: Raiz Mohammed / Jaidyn Edwards
+# Updated: 2025-10-20
+
+import os
+import queue
+import signal
+import threading
+import wave
+import pyaudio
+from datetime import datetime, timezone
+import ctypes
+from ctypes.util import find_library
+
+# Suppress ALSA warnings (from PyAudio backend)
+try:
+    def py_error_handler(filename, line, function, err, fmt):
+        pass  # Do nothing (silence ALSA C errors)
+
+    c_error_handler = ctypes.CFUNCTYPE(
+        None,
+        ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p,
+        ctypes.c_int, ctypes.c_char_p
+    )(py_error_handler)
+
+    asound = ctypes.CDLL(find_library('asound'))
+    asound.snd_lib_error_set_handler(c_error_handler)
+except Exception:
+    pass
+
+# Determine project root dynamically
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import node_config
+from media_index import MediaIndex
+from ship_manifest import ShipManifest, manifest_path
+from compress_audio import CompressionWorker
+import acoustic_features
+from spectrogram_preview import PreviewPool
+
+
+# -----------------------------
+# Shared recording helpers
+# -----------------------------
+
+def write_chunks(stream, wf, n_chunks, chunk, chunk_bytes, stop=None):
+    """
+    Read n_chunks from an open input stream and write each one straight to
+    the open wave file, ending early once stop() returns True.
+    Returns (chunks_written, overflows, underruns).
+    """
+    silence = b"\x00" * chunk_bytes
+    overflows = 0
+    underruns = 0
+    chunks_written = 0
+    for _ in range(n_chunks):
+        if stop is not None and stop():
+            break
+        try:
+            data = stream.read(chunk, exception_on_overflow=True)
+        except IOError as e:
+            if getattr(e, "errno", None) != pyaudio.paInputOverflowed:
+                raise
+            # Samples were dropped by the device; keep the timeline
+            # intact with silence and report it instead of hiding it
+            overflows += 1
+            data = silence
+        if len(data) < chunk_bytes:
+            underruns += 1
+            data = data + silence[len(data):]
+        wf.writeframes(data)
+        chunks_written += 1
+    return chunks_written, overflows, underruns
+
+
+# Entries may be completed from the preview and compression threads
+_entry_lock = threading.Lock()
+
+
+def preview_dir(global_config):
+    """Previews go straight to the shipping directory, ahead of the raw audio."""
+    node_id = global_config.get("node_id", "unknown-node")
+    return os.path.join(global_config.get("ship_dir", "/home/pi/shipping"), f"previews-{node_id}")
+
+
+def make_previewer(audio_config, global_config):
+    """PreviewPool for the configured "preview" format, or None if previews are off."""
+    fmt = audio_config.get("preview")
+    if not fmt:
+        return None
+    manifest = ShipManifest(manifest_path(global_config), global_config.get("ship_dir", "/home/pi/shipping"),
+                            node_id=global_config.get("node_id"))
+    return PreviewPool(preview_dir(global_config), fmt,
+                       bins=audio_config.get("preview_bins", 128),
+                       width=audio_config.get("preview_width", 256),
+                       manifest=manifest)
+
+
+def finish_segment(wav_filename, record_entry, audio_config, compressor, write_entry, previewer=None):
+    """
+    Post-record stage for one closed WAV: acoustic features, optional silence
+    culling, optional spectrogram preview, optional FLAC compression, then
+    write_entry(record_entry).
+
+    With "features": true the segment's summary is stored under
+    record_entry["features"]. If "silence_threshold" is set, the segment's
+    activity index is below it and its level is below "silence_floor_dbfs"
+    (see acoustic_features.is_silent), the audio file is deleted and only
+    the features are kept. The preview is rendered from the WAV before it is
+    handed to the compressor, which deletes it once the FLAC is verified.
+    """
+    def write(entry):
+        with _entry_lock:
+            write_entry(entry)
+
+    if audio_config.get("features", False):
+        try:
+            bands = audio_config.get("feature_bands", acoustic_features.DEFAULT_BANDS)
+            features = acoustic_features.analyze_wav(wav_filename, bands)
+            record_entry["features"] = features
+        except Exception as e:
+            print(f"[BEAM] WARNING: feature extraction failed for {wav_filename}: {e}")
+            features = None
+
+        threshold = audio_config.get("silence_threshold")
+        floor = audio_config.get("silence_floor_dbfs", acoustic_features.SILENCE_FLOOR_DBFS)
+        if features is not None and threshold is not None and acoustic_features.is_silent(features, threshold, floor):
+            os.remove(wav_filename)
+            record_entry["file"] = None
+            record_entry["audio_dropped"] = "below_activity_threshold"
+            write(record_entry)
+            return
+
+    def compress_and_write():
+        if compressor is None:
+            write(record_entry)
+            return
+
+        def on_compressed(info):
+            if info is not None:
+                record_entry.update(info)
+            write(record_entry)
+        compressor.submit(wav_filename, on_compressed)
+
+    if previewer is None:
+        compress_and_write()
+        return
+
+    def on_preview(path):
+        record_entry["preview"] = path
+        compress_and_write()
+    previewer.submit(wav_filename, on_preview)
+
+
+class SegmentFinisher:
+    """
+    Background thread that runs finish_segment() for closed segments in
+    order, so a capture loop does nothing but read the stream and write
+    WAVs. Feature extraction, hashing and the index fsync would otherwise
+    stall the reads long enough to overflow the input buffer.
+    """
+
+    def __init__(self, audio_config, compressor, write_entry, previewer=None, log=print):
+        self.audio_config = audio_config
+        self.compressor = compressor
+        self.write_entry = write_entry
+        self.previewer = previewer
+        self.log = log
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="segment-finisher", daemon=True)
+        self.thread.start()
+
+    def submit(self, wav_filename, record_entry):
+        self.jobs.put((wav_filename, record_entry))
+
+    def _run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)  # this thread only
+        except (AttributeError, OSError):
+            pass
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            wav_filename, record_entry = job
+            try:
+                finish_segment(wav_filename, record_entry, self.audio_config, self.compressor,
+                               self.write_entry, self.previewer)
+            except Exception as e:
+                self.log(f"[BEAM] ERROR: could not finish {wav_filename}: {e}")
+
+    def close(self):
+        """Finish every queued segment, then stop the worker."""
+        self.jobs.put(None)
+        self.thread.join()
+
+
+# -----------------------------
+# Sensor host interface: init / read / close
+# -----------------------------
+# The scheduler's sensor host keeps the PyAudio instance returned by init()
+# alive across recordings. Running this file directly still does one full
+# init/read/close cycle.
+
+def init(config):
+    """Initialize the PyAudio interface (and preview/FLAC workers if enabled). Returns the recorder context."""
+    audio_config = config["audio"]
+    # Previews render in separate low-priority processes (see spectrogram_preview.py)
+    ctx = {"previewer": make_previewer(audio_config, config["global"]),
+           "audio": pyaudio.PyAudio(), "compressor": None}
+    if audio_config.get("compress") == "flac":
+        ctx["compressor"] = CompressionWorker(level=audio_config.get("flac_level", 5))
+    return ctx
+
+
+def read(ctx, config):
+    """Record one clip of duration_sec, streaming it to a WAV file, and add it to the media index."""
+    audio = ctx["audio"]
+    audio_config = config["audio"]
+    global_config = config["global"]
+
+    # Base directory: /home/pi/data/audio
+    base_dir = global_config.get("base_dir", os.path.join(project_root, "data"))
+    directory = os.path.join(base_dir, audio_config.get("directory", "audio"))
+    os.makedirs(directory, exist_ok=True)
+
+    # File path setup
+    timestamp = datetime.now(timezone.utc).isoformat()
+    file_prefix = audio_config.get("file_prefix", "recording_")
+    wav_filename = os.path.join(directory, f"{file_prefix}{timestamp}.wav")
+
+    # Replace : with - in filename to avoid invalid characters
+    wav_filename = wav_filename.replace(":", "-")
+
+    # Recording parameters
+    DURATION = audio_config.get("duration_sec", 10)
+    RATE = audio_config.get("sample_rate", 48000)
+    CHANNELS = audio_config.get("channels", 1)
+    FORMAT = pyaudio.paInt16 if audio_config.get("format", "int16") == "int16" else pyaudio.paFloat32
+    CHUNK = audio_config.get("chunk", 1024)
+
+    sample_width = audio.get_sample_size(FORMAT)
+    chunk_bytes = CHUNK * CHANNELS * sample_width
+
+    stream = audio.open(format=FORMAT, channels=CHANNELS,
+                        rate=RATE, input=True,
+                        frames_per_buffer=CHUNK)
+
+    if global_config.get("print_debug", True):
+        print(f"[BEAM] Recording {DURATION}s of audio to {wav_filename}")
+
+    # Chunks are streamed straight into the WAV file as they are read, so
+    # memory stays at one chunk no matter how long the recording is. The
+    # wave module re-patches the header length after every writeframes()
+    # call, so even a killed recorder leaves a valid file holding every
+    # chunk written so far.
+    try:
+        with wave.open(wav_filename, 'wb') as wf:
+            wf.setnchannels(CHANNELS)
+            wf.setsampwidth(sample_width)
+            wf.setframerate(RATE)
+            chunks_written, overflows, underruns = write_chunks(
+                stream, wf, int(RATE / CHUNK * DURATION), CHUNK, chunk_bytes)
+    finally:
+        stream.stop_stream()
+        stream.close()
+
+    if overflows or underruns:
+        print(f"[BEAM] WARNING: {overflows} overflow(s), {underruns} underrun(s) in {wav_filename}")
+
+    if global_config.get("print_debug", True):
+        print(f"[BEAM] Saved audio file: {wav_filename}")
+
+    # New record entry
+    record_entry = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "file": wav_filename,
+        "duration_sec": DURATION,
+        "sample_rate": RATE,
+        "channels": CHANNELS,
+        "format": "int16",
+        "frames": chunks_written * CHUNK,
+        "overflows": overflows,
+        "underruns": underruns
+    }
+
+    # Add to the directory's media index once features/culling/compression
+    # are done (MASTER.json is exported from it on demand, see media_index.py)
+    index = MediaIndex(directory, node_id=global_config.get("node_id"), sensor="audio",
+                       rollover_sec=global_config.get("rollover_sec", 3600))
+    finish_segment(wav_filename, record_entry, audio_config, ctx.get("compressor"),
+                   index.add, previewer=ctx.get("previewer"))
+
+    if global_config.get("print_debug", True):
+        print(f"[BEAM] Logged record to {index.path}")
+    return record_entry
+
+
+def close(ctx):
+    """Terminate the PyAudio interface, finishing any queued previews and compression first."""
+    if ctx.get("previewer") is not None:
+        ctx["previewer"].close()  # may still hand segments to the compressor
+    if ctx.get("compressor") is not None:
+        ctx["compressor"].close()
+    ctx["audio"].terminate()
+
+
+def _raise_on_sigterm(signum, frame):
+    # Turn the scheduler's SIGTERM into an exception so the WAV file is
+    # closed (and its header finalized) on the way out
+    raise SystemExit(128 + signum)
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, _raise_on_sigterm)
+
+    # Load config
+    config = node_config.load()
+
+    ctx = init(config)
+    try:
+        read(ctx, config)
+    finally:
+        close(ctx)
@@ -0,0 +1,194 @@
+"""
+spectrogram_preview.py: Small spectrogram previews of recorded segments.
+
+Each closed segment is reduced to a compact log-power spectrogram, so
+audio can be triaged on the supervisor before the full WAV/FLAC files are
+transferred. The segment is cut into Hann-windowed frames, transformed with
+one batched rFFT, and the power is averaged down to "preview_bins" frequency
+rows x "preview_width" time columns. It is then mapped to uint8 over a
+PREVIEW_RANGE_DB dynamic range.
+
+Previews are written as a grayscale PNG (no imaging library needed) or as
+a raw uint8 .npy array. They go straight into the shipping directory, so
+the next pull from the supervisor collects them ahead of the raw audio.
+
+Generation runs in a PreviewPool: each preview is rendered by this script
+in its own interpreter, started at the lowest CPU priority, so spectrogram
+work never holds the recorder's GIL or a CPU that capture needs. The
+recorder may already be running threads (the scheduler's sensor host, log
+and pool threads). Forking such a process without exec can deadlock the
+child, and spawn/forkserver pools would re-run the recorder script itself.
+Starting the script as a subprocess (fork+exec) avoids both problems.
+
+Usage from the command line:
+    python3 spectrogram_preview.py /home/pi/data/audio/recording_....wav [out_dir] [png|npy] [bins] [width]
+
+Author: BEAM Project
+"""
+
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import wave
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # previews are optional; callers check HAVE_NUMPY
+    np = None
+
+HAVE_NUMPY = np is not None
+
+FRAME = 1024
+PREVIEW_BINS = 128
+PREVIEW_WIDTH = 256
+PREVIEW_RANGE_DB = 80.0
+EPS = 1e-12
+# Render previews as an idle-priority job (nice 19, idle I/O class)
+LOW_PRIORITY = (["nice", "-n", "19"] + (["ionice", "-c", "3"] if shutil.which("ionice") else []))
+
+
+def _downsample(a, n, axis):
+    """Average a (non-negative) array down to at most n groups along axis."""
+    length = a.shape[axis]
+    if length <= n:
+        return a
+    edges = np.linspace(0, length, n + 1).astype(int)
+    return np.add.reduceat(a, edges[:-1], axis=axis) / np.diff(edges).reshape(
+        (-1, 1) if axis == 0 else (1, -1))
+
+
+def spectrogram_uint8(samples, channels=1, frame=FRAME, bins=PREVIEW_BINS, width=PREVIEW_WIDTH):
+    """
+    uint8 spectrogram of an int16 buffer, shape (freq rows, time columns),
+    lowest frequency in the last row so it displays the usual way up.
+    """
+    x = np.asarray(samples, dtype=np.int16).astype(np.float32) / 32768.0
+    if channels > 1:
+        x = x[: len(x) - len(x) % channels].reshape(-1, channels).mean(axis=1)
+    if len(x) < frame:
+        x = np.pad(x, (0, frame - len(x)))
+
+    n_frames = len(x) // frame
+    frames = x[: n_frames * frame].reshape(n_frames, frame) * np.hanning(frame).astype(np.float32)
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2     # (time, freq)
+
+    power = _downsample(_downsample(power, width, axis=0), bins, axis=1)
+    db = 10.0 * np.log10(power.T + EPS)                   # (freq, time)
+    top = db.max()
+    scaled = (db - (top - PREVIEW_RANGE_DB)) * (255.0 / PREVIEW_RANGE_DB)
+    return np.clip(scaled, 0, 255).astype(np.uint8)[::-1]
+
+
+def write_png(path, image):
+    """Write a 2-D uint8 array as an 8-bit grayscale PNG."""
+    height, width = image.shape
+    raw = b"".join(b"\x00" + image[row].tobytes() for row in range(height))
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, 9)))
+        f.write(chunk(b"IEND", b""))
+
+
+def make_preview(wav_path, out_dir, fmt="png", bins=PREVIEW_BINS, width=PREVIEW_WIDTH, frame=FRAME):
+    """
+    Write the preview of wav_path into out_dir and return its path. The file
+    is written under a temporary name and renamed, so a concurrent transfer
+    never picks up a half-written preview.
+    """
+    if not HAVE_NUMPY:
+        raise ImportError("numpy is required for spectrogram previews (sudo apt install python3-numpy)")
+    with wave.open(wav_path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{wav_path}: only int16 WAVs are supported")
+        channels = wf.getnchannels()
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype="<i2")
+    image = spectrogram_uint8(samples, channels, frame, bins, width)
+
+    os.makedirs(out_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(wav_path))[0]
+    preview_path = os.path.join(out_dir, f"{name}.{fmt}")
+    tmp_path = preview_path + ".part"
+    if fmt == "png":
+        write_png(tmp_path, image)
+    elif fmt == "npy":
+        with open(tmp_path, "wb") as f:
+            np.save(f, image)
+    else:
+        raise ValueError(f"unknown preview format {fmt!r}")
+    os.replace(tmp_path, preview_path)
+    return preview_path
+
+
+def render_in_subprocess(wav_path, out_dir, fmt="png", bins=PREVIEW_BINS, width=PREVIEW_WIDTH):
+    """Run make_preview() in a fresh low-priority interpreter and return the preview path."""
+    result = subprocess.run(LOW_PRIORITY + [sys.executable, os.path.abspath(__file__),
+                                            wav_path, out_dir, fmt, str(bins), str(width)],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f"exit status {result.returncode}")
+    return result.stdout.strip().splitlines()[-1]
+
+
+class PreviewPool:
+    """
+    Low-priority worker pool for make_preview(), one subprocess per preview.
+
+    submit(wav_path, on_done) queues a segment; on_done(path) is called in
+    the parent with the preview path, or with None if generation failed.
+    The WAV must stay on disk until on_done has run. With a ShipManifest
+    every preview is also registered for the supervisor's delta sync.
+    """
+
+    def __init__(self, out_dir, fmt="png", bins=PREVIEW_BINS, width=PREVIEW_WIDTH,
+                 workers=1, log=print, manifest=None):
+        self.out_dir = out_dir
+        self.manifest = manifest
+        self.fmt = fmt
+        self.bins = bins
+        self.width = width
+        self.log = log
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preview")
+
+    def submit(self, wav_path, on_done):
+        future = self.pool.submit(render_in_subprocess, wav_path, self.out_dir, self.fmt, self.bins, self.width)
+
+        def done(f):
+            try:
+                path = f.result()
+                if self.manifest is not None:
+                    self.manifest.add([path])
+            except Exception as e:
+                self.log(f"[BEAM] WARNING: preview failed for {os.path.basename(wav_path)}: {e}")
+                path = None
+            try:
+                on_done(path)
+            except Exception as e:
+                self.log(f"[BEAM] ERROR: preview callback failed: {e}")
+
+        future.add_done_callback(done)
+
+    def close(self):
+        """Finish every queued preview (and its callback), then stop the workers."""
+        self.pool.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    if not 2 <= len(sys.argv) <= 6:
+        print("usage: spectrogram_preview.py <file.wav> [out_dir] [png|npy] [bins] [width]")
+        raise SystemExit(2)
+    out = sys.argv[2] if len(sys.argv) > 2 else os.path.dirname(os.path.abspath(sys.argv[1]))
+    fmt = sys.argv[3] if len(sys.argv) > 3 else "png"
+    bins = int(sys.argv[4]) if len(sys.argv) > 4 else PREVIEW_BINS
+    width = int(sys.argv[5]) if len(sys.argv) > 5 else PREVIEW_WIDTH
+    print(make_preview(sys.argv[1], out, fmt, bins, width))
@@ -0,0 +1,166 @@
+"""
+dedupe_images.py: Near-duplicate suppression for motion camera bursts.
+
+Walks the camera media index and computes a 64-bit dHash for every image
+that has not been hashed yet. JPEGs are decoded in draft mode at reduced
+scale, so no full-resolution decode is needed. Hashes are kept in
+dhash_cache.json next to the images, keyed on file name, size and mtime,
+so each run only hashes files that are new.
+
+Images are then walked in time order. An image within "dedupe_window_sec"
+of a kept representative, and within "dedupe_max_distance" bits (Hamming
+distance) of its hash, is marked as a duplicate. The mark is a new index
+entry for the same file with "duplicate_of" set (see media_index.py: the
+last entry per file wins). The mark is stamped with the time of this pass and
+keeps the capture time in "captured_at", so the index stays in time order.
+Pre-trigger frames are never marked.
+
+shipping.py runs this pass first when the camera "dedupe" option is on.
+With "ship_duplicates": false the marked files are held back on the node.
+
+Usage from the command line:
+    python3 dedupe_images.py [/home/pi/data/camera]
+
+Author: BEAM Project
+"""
+
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import node_config
+from media_index import MediaIndex, capture_time, to_epoch
+
+CACHE_NAME = "dhash_cache.json"
+HASH_SIZE = 8
+
+
+def dhash(path, size=HASH_SIZE):
+    """Difference hash: sign of horizontal gradients on a (size+1) x size thumbnail."""
+    with Image.open(path) as img:
+        img.draft("L", (size * 8, size * 8))  # JPEG DCT scaling: decode at 1/2..1/8 size
+        thumb = img.convert("L").resize((size + 1, size), Image.BILINEAR)
+        pixels = list(thumb.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def load_cache(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_cache(path, cache):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+
+def cached_hash(cache, path):
+    """dHash of path from the cache, hashing (and caching) it if it is new or changed."""
+    st = os.stat(path)
+    key = os.path.basename(path)
+    hit = cache.get(key)
+    if hit and hit["size"] == st.st_size and hit["mtime"] == st.st_mtime_ns:
+        return int(hit["dhash"], 16), False
+    value = dhash(path)
+    cache[key] = {"size": st.st_size, "mtime": st.st_mtime_ns, "dhash": f"{value:016x}"}
+    return value, True
+
+
+def dedupe(directory, window_sec=60, max_distance=6, node_id=None, rollover_sec=3600, log=print):
+    """
+    Mark near-duplicates in directory's media index.
+    Returns {"hashed", "duplicates", "marked"}: files hashed this run, total
+    duplicates, and duplicates newly marked this run.
+    """
+    index = MediaIndex(directory, node_id=node_id, sensor="camera", rollover_sec=rollover_sec)
+    cache_path = os.path.join(directory, CACHE_NAME)
+    cache = load_cache(cache_path)
+
+    entries = [e for e in index.latest().values()
+               if not e.get("pretrigger") and os.path.isfile(e["file"])]
+    entries.sort(key=lambda e: to_epoch(capture_time(e)))
+
+    hashed = 0
+    duplicates = 0
+    marks = []
+    reps = []  # (epoch, hash, file) of kept images still inside the window
+    for entry in entries:
+        try:
+            value, fresh = cached_hash(cache, entry["file"])
+        except OSError as e:
+            log(f"[WARN] Cannot hash {entry['file']}: {e}")
+            continue
+        hashed += fresh
+        t = to_epoch(capture_time(entry))
+        reps = [r for r in reps if t - r[0] <= window_sec]
+
+        if entry.get("duplicate_of"):
+            duplicates += 1
+            continue
+        match = next((r for r in reps if hamming(r[1], value) <= max_distance), None)
+        if match is None:
+            reps.append((t, value, entry["file"]))
+            continue
+        duplicates += 1
+        marks.append(dict(entry, captured_at=capture_time(entry), dhash=f"{value:016x}",
+                          duplicate_of=match[2], hash_distance=hamming(match[1], value)))
+
+    marked_at = datetime.now(timezone.utc).isoformat()
+    for mark in marks:
+        mark["timestamp"] = marked_at  # appended now; the capture time is in captured_at
+        index.add(mark, checksum=False)  # size/sha256 are carried over from the original entry
+    # Forget files that have been shipped off the node
+    live = {os.path.basename(e["file"]) for e in entries}
+    save_cache(cache_path, {k: v for k, v in cache.items() if k in live})
+    log(f"[BEAM] Dedupe {directory}: hashed {hashed} new, marked {len(marks)} new duplicate(s), "
+        f"{duplicates} duplicate(s) of {len(entries)} image(s)")
+    return {"hashed": hashed, "duplicates": duplicates, "marked": len(marks)}
+
+
+def duplicate_files(directory):
+    """Files currently marked as duplicates in directory's media index."""
+    return [f for f, e in MediaIndex(directory).latest().items() if e.get("duplicate_of")]
+
+
+def run(config=None):
+    """Run the pass over base_dir/<camera directory> using config.json settings."""
+    config = config or node_config.load()
+    global_config = node_config.global_config()
+    cam_config = config.get("camera", {})
+    directory = os.path.join(global_config.get("base_dir", "/home/pi/data"), cam_config.get("directory", "camera"))
+    if not os.path.isdir(directory):
+        return None
+    return dedupe(directory,
+                  window_sec=cam_config.get("dedupe_window_sec", 60),
+                  max_distance=cam_config.get("dedupe_max_distance", 6),
+                  node_id=global_config.get("node_id"),
+                  rollover_sec=global_config.get("rollover_sec", 3600))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        cam_config = node_config.section("camera")
+        dedupe(sys.argv[1],
+               window_sec=cam_config.get("dedupe_window_sec", 60),
+               max_distance=cam_config.get("dedupe_max_distance", 6))
+    else:
+        run()
@@ -4,29 +4,54 @@ Author: Gabriel Gonzales, Raiz Mohammed
 Date: 2025-10-20
 
 Detects motion on GPIO pin (default: 4) and captures images using PiCamera2.
-All parameters are loaded from config.json. Images and JSON metadata are saved
-under /home/pi/data/camera/.
+All parameters are loaded from config.json. Images are saved under
+/home/pi/data/camera/ and indexed in media_index.jsonl (images_log.json can
+be exported from it with media_index.py).
+
+The trigger loop only grabs the frame into memory and puts it on a bounded
+queue ("queue_size", default 8). A writer thread does the JPEG encode, the
+SD card write and the index entry, so PIR events are not missed while a
+previous frame is still being saved. If the queue is full the new frame is
+dropped and counted. Every record carries trigger-to-grab and grab-to-disk
+latencies, and a stats line is printed every "stats_interval_sec".
+
+With "pretrigger_frames" > 0 a grabber thread keeps the last N lores frames
+(grayscale, "lores_resolution") in a preallocated ring buffer at
+"pretrigger_fps". On a trigger the ring is snapshotted and those frames are
+saved with the still, so the seconds before the PIR fired are kept too.
+
+With "verify_motion": true a PIR trigger must be confirmed visually before
+a full-resolution still is taken. Consecutive lores frames are block-averaged
+by "verify_downscale" and differenced. The trigger counts as real motion if
+the share of pixels changing by more than "verify_pixel_threshold" reaches
+"verify_min_ratio". Rejected triggers are counted as false triggers, and the
+stats line reports the verify rate so the thresholds can be tuned.
 """
 
 
 import os
-import json
+import sys
+import queue
+import signal
+import threading
 import time
 from datetime import datetime, timezone
+import numpy as np
 from gpiozero import MotionSensor
-from picamera2 import Picamera2
+from picamera2 import Picamera2, MappedArray
+from PIL import Image
 
 # -----------------------------
 # Load configuration
 # -----------------------------
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
-config_path = os.path.join(project_root, "config.json")
 
-with open(config_path, "r") as f:
-    config = json.load(f)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import node_config
+from media_index import MediaIndex
 
-global_config = config.get("global", {})
-cam_config = config.get("camera", {})
+global_config = node_config.global_config()
+cam_config = node_config.section("camera")
 
 
 
@@ -38,7 +63,8 @@ base_dir = global_config.get("base_dir", os.path.join(project_root, "data"))
 # -----------------------------
 directory = os.path.join(base_dir, cam_config.get("directory", "camera"))
 os.makedirs(directory, exist_ok=True)
-log_path = os.path.join(directory, "images_log.json")
+index = MediaIndex(directory, node_id=node_id, sensor="camera",
+                   rollover_sec=global_config.get("rollover_sec", 3600))
 
 # -----------------------------
 # Motion sensor and camera setup
@@ -59,50 +85,258 @@ time.sleep(1)  # allow sensor to warm up
 if global_config.get("print_debug", True):
     print(f"[BEAM] Motion camera armed on GPIO {gpio_pin}, waiting for movement...")
 
-i = 0
 cooldown = cam_config.get("cooldown_sec", 1)
+jpeg_quality = cam_config.get("jpeg_quality", 90)
+stats_interval = cam_config.get("stats_interval_sec", 600)
+frames = queue.Queue(maxsize=cam_config.get("queue_size", 8))
+
+# Counters shared by the trigger loop and the writer thread
+stats_lock = threading.Lock()
+stats = {"triggers": 0, "captured": 0, "written": 0, "dropped": 0,
+         "write_errors": 0, "max_queue_depth": 0, "max_trigger_latency_ms": 0.0,
+         "pretrigger_written": 0, "verify_passed": 0, "false_triggers": 0}
+
+def bump(key, value=1):
+    with stats_lock:
+        stats[key] += value
+
+def log_stats():
+    with stats_lock:
+        snapshot = dict(stats)
+    snapshot["queue_depth"] = frames.qsize()
+    checked = snapshot["verify_passed"] + snapshot["false_triggers"]
+    if checked:
+        snapshot["verify_rate"] = round(snapshot["verify_passed"] / checked, 3)
+    print(f"[BEAM] Camera stats: {snapshot}")
 
 # -----------------------------
-# Motion detection loop
+# Pre-trigger ring buffer (lores luma frames)
 # -----------------------------
-while True:
-    pir.wait_for_motion()
-    timestamp = datetime.now(timezone.utc).isoformat()
+class FrameRing:
+    """
+    Fixed-size ring of grayscale frames. All storage is allocated up front,
+    so memory stays flat however long the camera runs.
+    """
 
-    filename = f"{cam_config.get('file_prefix', 'motionpic_')}{timestamp}.jpg"
-    file_path = os.path.join(directory, filename)
+    def __init__(self, size, width, height):
+        self.frames = np.zeros((size, height, width), dtype=np.uint8)
+        self.times = np.zeros(size, dtype=np.float64)
+        self.size = size
+        self.next = 0
+        self.count = 0
+        self.lock = threading.Lock()
 
-    if global_config.get("print_debug", True):
-        print(f"[BEAM] Motion detected — capturing {filename}")
+    def push_from(self, luma, when):
+        """Copy a (height, width) view into the oldest slot."""
+        with self.lock:
+            np.copyto(self.frames[self.next], luma)
+            self.times[self.next] = when
+            self.next = (self.next + 1) % self.size
+            self.count = min(self.count + 1, self.size)
 
-    # Capture image
-    picam.capture_file(file_path)
+    def snapshot(self):
+        """
+        Copy of the buffered frames, oldest first, and their epoch times. The
+        copy only lives until the writer has saved it, so queued snapshots
+        are bounded by "queue_size".
+        """
+        with self.lock:
+            order = (np.arange(self.count) + self.next - self.count) % self.size
+            return self.frames[order], self.times[order].tolist()
 
-    # Log metadata
-    record = {
-        "timestamp": timestamp,
-        "file": file_path
-    }
-
-    # Append to log JSON
+def with_luma(callback):
+    """Capture one frame and call callback(luma) with a zero-copy view of its lores Y plane."""
+    lores_w, lores_h = lores_res
+    request = picam.capture_request()
     try:
-        if os.path.exists(log_path):
-            with open(log_path, "r") as f:
-                try:
-                    data = json.load(f)
-                    if not isinstance(data, dict) or "records" not in data:
-                        data = {"node_id": node_id, "sensor": "camera", "records": []}
-                except Exception:
-                    data = {"node_id": node_id, "sensor": "camera", "records": []}
-        else:
-            data = {"node_id": node_id, "sensor": "camera", "records": []}
+        # The first rows of the YUV420 lores buffer are the Y plane
+        with MappedArray(request, "lores") as m:
+            return callback(m.array[:lores_h, :lores_w])
+    finally:
+        request.release()
+
+def pretrigger_grabber(ring, interval):
+    while True:
+        started = time.monotonic()
+        with_luma(lambda luma: ring.push_from(luma, time.time()))
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+ring = None
+if cam_config.get("pretrigger_frames", 0) > 0:
+    ring = FrameRing(cam_config["pretrigger_frames"], *lores_res)
+    threading.Thread(target=pretrigger_grabber, name="pretrigger-grabber", daemon=True,
+                     args=(ring, 1.0 / cam_config.get("pretrigger_fps", 5))).start()
+
+def write_pretrigger(pre, timestamp):
+    """Save and index the frames that were in the ring when the trigger fired."""
+    pre_frames, pre_times, trigger_epoch = pre
+    prefix = cam_config.get("file_prefix", "motionpic_")
+    for k, (luma, when) in enumerate(zip(pre_frames, pre_times)):
+        file_path = os.path.join(directory, f"{prefix}{timestamp}_pre{k:02d}.jpg")
+        try:
+            Image.fromarray(luma, "L").save(file_path, quality=jpeg_quality)
+            index.add({
+                "timestamp": datetime.fromtimestamp(when, timezone.utc).isoformat(),
+                "file": file_path,
+                "pretrigger": True,
+                "trigger_timestamp": timestamp,
+                "offset_sec": round(when - trigger_epoch, 3)
+            })
+            bump("pretrigger_written")
+        except Exception as e:
+            bump("write_errors")
+            print(f"[ERROR] Failed to save pre-trigger frame {file_path}: {e}")
+
+# -----------------------------
+# Frame-difference motion verification
+# -----------------------------
+verify_downscale = cam_config.get("verify_downscale", 4)
+verify_pixel_threshold = cam_config.get("verify_pixel_threshold", 25)
+verify_min_ratio = cam_config.get("verify_min_ratio", 0.01)
+verify_frames = cam_config.get("verify_frames", 3)
+verify_interval = cam_config.get("verify_interval_sec", 0.1)
+
+def downscale(luma):
+    """Block-average a luma frame by verify_downscale (int16, ready to subtract)."""
+    f = verify_downscale
+    h, w = luma.shape[0] // f * f, luma.shape[1] // f * f
+    blocks = luma[:h, :w].reshape(h // f, f, w // f, f)
+    return blocks.mean(axis=(1, 3), dtype=np.float32).astype(np.int16)
+
+def changed_ratio(a, b):
+    """Share of downscaled pixels whose brightness changed by more than the threshold."""
+    return float(np.count_nonzero(np.abs(a - b) > verify_pixel_threshold)) / a.size
+
+def verify_motion():
+    """
+    Compare up to verify_frames consecutive lores frames. Returns (confirmed,
+    best changed-pixel ratio). The newest pre-trigger frame, if there is one,
+    serves as the first reference.
+    """
+    previous = None
+    if ring is not None and ring.count:
+        previous = downscale(ring.snapshot()[0][-1])
+    best = 0.0
+    for _ in range(verify_frames + (previous is None)):
+        current = with_luma(downscale)
+        if previous is not None:
+            best = max(best, changed_ratio(previous, current))
+            if best >= verify_min_ratio:
+                return True, best
+        previous = current
+        time.sleep(verify_interval)
+    return False, best
 
-        data["records"].append(record)
-        with open(log_path, "w") as f:
-            json.dump(data, f, indent=4)
+# -----------------------------
+# Writer thread: encode, persist, index
+# -----------------------------
+def writer():
+    while True:
+        item = frames.get()
+        if item is None:
+            return
+        image, timestamp, trigger_latency_ms, grabbed_at, pre, motion_ratio = item
+
+        if pre is not None:
+            write_pretrigger(pre, timestamp)
+
+        filename = f"{cam_config.get('file_prefix', 'motionpic_')}{timestamp}.jpg"
+        file_path = os.path.join(directory, filename)
+        try:
+            image.save(file_path, quality=jpeg_quality)
+        except Exception as e:
+            bump("write_errors")
+            print(f"[ERROR] Failed to save {filename}: {e}")
+            continue
+
+        # Log metadata
+        record = {
+            "timestamp": timestamp,
+            "file": file_path,
+            "trigger_latency_ms": trigger_latency_ms,
+            "write_latency_ms": round((time.monotonic() - grabbed_at) * 1000, 1),
+            "queue_depth": frames.qsize()
+        }
+        if pre is not None:
+            record["pretrigger_frames"] = len(pre[1])
+        if motion_ratio is not None:
+            record["motion_ratio"] = round(motion_ratio, 4)
+
+        # Append to the media index (one line, with size and checksum)
+        try:
+            index.add(record)
+        except Exception as e:
+            print(f"[ERROR] Failed to save image log: {e}")
+        bump("written")
+
+writer_thread = threading.Thread(target=writer, name="camera-writer", daemon=True)
+writer_thread.start()
+
+def _raise_on_sigterm(signum, frame):
+    raise SystemExit(128 + signum)
+
+signal.signal(signal.SIGTERM, _raise_on_sigterm)
+
+# -----------------------------
+# Motion detection loop
+# -----------------------------
+last_stats = time.monotonic()
+try:
+    while True:
+        pir.wait_for_motion()
+        triggered_at = time.monotonic()
+        trigger_epoch = time.time()
+        timestamp = datetime.fromtimestamp(trigger_epoch, timezone.utc).isoformat()
+        bump("triggers")
+
+        # Freeze what the ring saw before the PIR fired
+        pre = None
+        if ring is not None:
+            pre_frames, pre_times = ring.snapshot()
+            pre = (pre_frames, pre_times, trigger_epoch)
+
+        # Only spend a full-resolution capture on visually confirmed motion
+        motion_ratio = None
+        if cam_config.get("verify_motion", False):
+            confirmed, motion_ratio = verify_motion()
+            if not confirmed:
+                bump("false_triggers")
+                if global_config.get("print_debug", True):
+                    print(f"[BEAM] PIR trigger not confirmed (changed ratio {motion_ratio:.4f} < {verify_min_ratio})")
+                time.sleep(cooldown)
+                continue
+            bump("verify_passed")
+
+        # Grab the frame into memory only; encoding happens in the writer
+        request = picam.capture_request()
+        try:
+            image = request.make_image("main")
+        finally:
+            request.release()
+        grabbed_at = time.monotonic()
+        trigger_latency_ms = round((grabbed_at - triggered_at) * 1000, 1)
+
+        try:
+            frames.put_nowait((image, timestamp, trigger_latency_ms, grabbed_at, pre, motion_ratio))
+        except queue.Full:
+            bump("dropped")
+            print(f"[WARN] Capture queue full, dropped frame at {timestamp}")
+        else:
+            bump("captured")
+            if global_config.get("print_debug", True):
+                print(f"[BEAM] Motion detected — captured frame {timestamp} ({trigger_latency_ms} ms)")
 
-    except Exception as e:
-        print(f"[ERROR] Failed to save image log: {e}")
+        with stats_lock:
+            stats["max_queue_depth"] = max(stats["max_queue_depth"], frames.qsize())
+            stats["max_trigger_latency_ms"] = max(stats["max_trigger_latency_ms"], trigger_latency_ms)
+        if time.monotonic() - last_stats >= stats_interval:
+            log_stats()
+            last_stats = time.monotonic()
 
-    i += 1
-    time.sleep(cooldown)
\ No newline at end of file
+        time.sleep(cooldown)
+finally:
+    # Let the writer finish every frame already grabbed
+    frames.put(None)
+    writer_thread.join()
+    picam.stop()
+    log_stats()
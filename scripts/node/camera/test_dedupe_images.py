@@ -0,0 +1,52 @@
+"""
+test_dedupe_images.py: Check that a dedupe pass leaves the media index in time order.
+
+Writes a burst of near-identical frames into a scratch directory, runs
+dedupe() over it and checks that MediaIndex.range() over the capture window
+still returns every original capture, and that the marks are found at the
+time of the pass.
+
+    python3 test_dedupe_images.py
+
+Author: BEAM Project
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from media_index import MediaIndex
+from dedupe_images import dedupe
+
+FRAMES = 12
+
+with tempfile.TemporaryDirectory() as directory:
+    index = MediaIndex(directory, node_id="test", sensor="camera", fsync=False)
+    start = time.time() - 600
+    for k in range(FRAMES):
+        path = os.path.join(directory, f"motionpic_{k:02d}.jpg")
+        ramp = [4 * x for x in range(64)]
+        if k >= FRAMES // 2:
+            ramp.reverse()  # two bursts of identical frames, opposite gradients
+        img = Image.new("L", (64, 48))
+        img.putdata(ramp * 48)
+        img.save(path)
+        index.add({"timestamp": datetime.fromtimestamp(start + 2 * k, timezone.utc).isoformat(),
+                   "file": path})
+
+    result = dedupe(directory, window_sec=60, max_distance=6, node_id="test")
+    assert result["marked"] == FRAMES - 2, result
+
+    captured = list(index.range(start, start + 2 * FRAMES))
+    assert len(captured) == FRAMES, f"range() returned {len(captured)} of {FRAMES} captures"
+    assert not any(e.get("duplicate_of") for e in captured), "range() returned marks, not captures"
+
+    marks = list(index.range(time.time() - 60, time.time()))
+    assert len(marks) == FRAMES - 2 and all(e.get("duplicate_of") and e.get("captured_at") for e in marks)
+
+print("[BEAM] Dedupe keeps the media index in time order")
@@ -17,9 +17,10 @@ MOVE_SCRIPT="$BASE/move_to_drive.sh"
 MOVE_MIN="0"
 MOVE_HOUR="17"
 
-# shipping time: 6:00 PM
-SHIP_MIN="0"
-SHIP_HOUR="18"
+# shipping: every hour at :05 (only sealed segments are moved, so it is
+# safe to run while the sensors are writing)
+SHIP_MIN="5"
+SHIP_HOUR="*"
 
 # delay after reboot (seconds)
 BOOT_DELAY="60"
@@ -0,0 +1,264 @@
+"""
+media_index.py: Per-directory, append-only index of captured media files.
+
+Replaces the MASTER.json (audio) and images_log.json (camera) documents,
+which were re-read and rewritten in full after every capture. Each media
+directory holds one media_index.jsonl in the record_log.py format (CRC32
+framed JSON Lines with a node_id/sensor header). Adding a file appends one
+line, whatever the size of the history:
+
+    index = MediaIndex("/home/pi/data/audio", node_id="node-1", sensor="audio")
+    index.add({"timestamp": "...", "file": "/home/pi/data/audio/rec.wav", ...})
+
+add() fills in the file's "size" and "sha256", so a transfer can be checked
+without reopening the original capture.
+
+Entries are appended in completion order, which is within MAX_SKEW_SEC of
+timestamp order. range(start, end) bisects on file offsets and reads only
+the frames around the requested window. compact() drops duplicate entries
+for the same file, optionally forgets files that no longer exist, and
+rewrites the index in exact timestamp order.
+
+Like the sensor logs, the index is split into time-bucketed segments
+(media_index.<bucket>.jsonl, see record_log.py) so sealed segments, and the
+media files they list, can be shipped while capture goes on. All methods
+below work across the segments still on the node.
+
+An entry is updated by appending a new entry for the same file (e.g. the
+duplicate marks written by camera/dedupe_images.py); latest() and compact()
+keep the last one. An update is stamped with the time it is appended, so the
+index stays in time order for range(); the capture time it carries over goes
+in "captured_at" (see capture_time()).
+
+The legacy documents can still be produced on demand:
+
+    python3 media_index.py export /home/pi/data/audio         # -> MASTER.json
+    python3 media_index.py range  /home/pi/data/camera 2025-10-20T00:00:00+00:00 2025-10-21T00:00:00+00:00
+    python3 media_index.py compact /home/pi/data/audio [--drop-missing]
+
+Author: BEAM Project
+"""
+
+import hashlib
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+from record_log import (HEADER_KEY, ROLLOVER_SEC, append_record, decode_frame, encode_frame,
+                        first_offset_where, log_files, read_records, segment_lock)
+
+INDEX_NAME = "media_index.jsonl"
+LEGACY_NAMES = {"audio": "MASTER.json", "camera": "images_log.json"}
+MAX_SKEW_SEC = 300
+
+
+def file_digest(path, block_size=1024 * 1024):
+    """SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def to_epoch(value):
+    """Seconds since the epoch for an ISO 8601 string, datetime or number."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def capture_time(record):
+    """When the media of an entry was captured: "captured_at" on updates, else "timestamp"."""
+    return record.get("captured_at", record.get("timestamp"))
+
+
+def _record_epoch(record):
+    try:
+        return to_epoch(record["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class MediaIndex:
+    """Append-only media index for one directory."""
+
+    def __init__(self, directory, node_id=None, sensor=None, name=INDEX_NAME, fsync=True,
+                 rollover_sec=ROLLOVER_SEC):
+        self.directory = directory
+        self.node_id = node_id
+        self.sensor = sensor
+        self.path = os.path.join(directory, name)  # base name; entries live in its segments
+        self.fsync = fsync
+        self.rollover_sec = rollover_sec
+
+    def segment_files(self):
+        """
+        [(bucket epoch or None, path)] of every index file on the node, in
+        order: the unsegmented legacy file first, then segments by bucket.
+        """
+        return log_files(self.path)
+
+    # -----------------------------
+    # Writing
+    # -----------------------------
+    def add(self, record, checksum=True):
+        """
+        Append one entry. If record["file"] exists, its size (and, with
+        checksum=True, its SHA-256) is added to the entry first.
+        """
+        path = record.get("file")
+        if path and os.path.isfile(path):
+            record["size"] = os.path.getsize(path)
+            if checksum:
+                record["sha256"] = file_digest(path)
+
+        append_record(self.path, record, node_id=self.node_id, sensor=self.sensor,
+                      fsync=self.fsync, rollover_sec=self.rollover_sec)
+        return record
+
+    # -----------------------------
+    # Reading
+    # -----------------------------
+    def records(self):
+        """Every entry in file order."""
+        records = []
+        for _, path in self.segment_files():
+            try:
+                records.extend(read_records(path)[1])
+            except FileNotFoundError:
+                pass  # shipped meanwhile
+        return records
+
+    def latest(self):
+        """{file: entry} keeping the last entry per file (later entries update earlier ones)."""
+        return {r["file"]: r for r in self.records() if r.get("file")}
+
+    def _first_offset_at(self, f, size, epoch):
+        """Offset of the first frame whose timestamp is >= epoch, by bisection."""
+        def reached(record):
+            t = _record_epoch(record)
+            return t is not None and t >= epoch
+        return first_offset_where(f, size, reached)
+
+    def range(self, start=None, end=None):
+        """
+        Yield entries with start <= timestamp <= end (ISO strings, datetimes
+        or epoch seconds; None leaves that side open), in file order.
+        """
+        lo = to_epoch(start) if start is not None else float("-inf")
+        hi = to_epoch(end) if end is not None else float("inf")
+
+        with segment_lock(self.directory, exclusive=False):
+            for bucket, path in self.segment_files():
+                # A segment holds entries appended during its bucket
+                if bucket is not None and (bucket + self.rollover_sec < lo - MAX_SKEW_SEC
+                                           or bucket - MAX_SKEW_SEC > hi):
+                    continue
+                try:
+                    f = open(path, "rb")
+                except FileNotFoundError:
+                    continue
+                with f:
+                    size = os.fstat(f.fileno()).st_size
+                    offset = 0 if lo == float("-inf") else self._first_offset_at(f, size, lo - MAX_SKEW_SEC)
+                    f.seek(offset)
+                    for line in f:
+                        obj = decode_frame(line)
+                        if not isinstance(obj, dict) or HEADER_KEY in obj:
+                            continue
+                        t = _record_epoch(obj)
+                        if t is None:
+                            continue
+                        if t > hi + MAX_SKEW_SEC:
+                            break
+                        if lo <= t <= hi:
+                            yield obj
+
+    # -----------------------------
+    # Maintenance
+    # -----------------------------
+    def compact(self, drop_missing=False):
+        """
+        Rewrite each index file on the node: one entry per media file (the
+        last one wins), entries whose file is gone dropped if drop_missing,
+        sorted by timestamp. Returns (entries_before, entries_after).
+        """
+        before = after = 0
+        with segment_lock(self.directory, exclusive=True):
+            for _, path in self.segment_files():
+                header, records = read_records(path)
+                latest = {}
+                for i, record in enumerate(records):
+                    key = record.get("file") or f"#{i}"  # culled entries have no file
+                    latest[key] = record
+                kept = [r for r in latest.values()
+                        if not (drop_missing and r.get("file") and not os.path.exists(r["file"]))]
+                kept.sort(key=lambda r: (_record_epoch(r) is None, _record_epoch(r) or 0.0))
+
+                header = {"node_id": header.get("node_id", self.node_id),
+                          "sensor": header.get("sensor", self.sensor)}
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(encode_frame({HEADER_KEY: header}))
+                    for record in kept:
+                        f.write(encode_frame(record))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+                before += len(records)
+                after += len(kept)
+        return before, after
+
+    # -----------------------------
+    # Compatibility exporter
+    # -----------------------------
+    def export_document(self):
+        """Rebuild the legacy {"node_id", "sensor", "records"} document."""
+        header = {}
+        for _, path in self.segment_files()[:1]:
+            header = read_records(path)[0]
+        records = self.records()
+        return {
+            "node_id": header.get("node_id", self.node_id),
+            "sensor": header.get("sensor", self.sensor),
+            "records": records,
+        }
+
+    def export_json(self, out_path=None):
+        """Write the legacy document (MASTER.json / images_log.json by default)."""
+        data = self.export_document()
+        if out_path is None:
+            out_path = os.path.join(self.directory, LEGACY_NAMES.get(data["sensor"], "index.json"))
+        tmp_path = f"{out_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, out_path)
+        return out_path
+
+
+if __name__ == "__main__":
+    usage = ("usage: media_index.py export <dir> [out.json]\n"
+             "       media_index.py range <dir> <start> <end>\n"
+             "       media_index.py compact <dir> [--drop-missing]")
+    if len(sys.argv) < 3:
+        print(usage)
+        raise SystemExit(2)
+    command, index = sys.argv[1], MediaIndex(sys.argv[2])
+    if command == "export":
+        out = index.export_json(sys.argv[3] if len(sys.argv) > 3 else None)
+        print(f"Exported {index.path} -> {out}")
+    elif command == "range" and len(sys.argv) == 5:
+        for entry in index.range(sys.argv[3], sys.argv[4]):
+            print(json.dumps(entry))
+    elif command == "compact":
+        before, after = index.compact(drop_missing="--drop-missing" in sys.argv[3:])
+        print(f"Compacted {index.path}: {before} -> {after} entries")
+    else:
+        print(usage)
+        raise SystemExit(2)
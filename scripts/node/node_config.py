@@ -0,0 +1,279 @@
+"""
+node_config.py: Shared, cached and validated view of config.json.
+
+Every node component (scheduler, sensor scripts, shipping) reads its settings
+through this module instead of opening config.json itself:
+
+    import node_config
+    cfg = node_config.load()               # full validated dict (cached)
+    g = node_config.global_config()        # "global" with defaults filled in
+    bme = node_config.section("bme280")
+
+The parsed file is cached and keyed on (mtime, size, inode), so repeated calls
+cost one os.stat(). The schema is validated once per change, including the
+"record_schema" blocks. If an edited file fails validation the last good
+config is kept and a warning is printed.
+
+Long-running components can register a callback with subscribe() and call
+check() periodically; callbacks only fire when the file actually changed.
+
+Writers batch their updates in a transaction. At commit it takes an
+exclusive lock on config.json.lock, merges every staged change into the
+current file and writes it with one atomic replace:
+
+    with node_config.transaction() as txn:
+        txn.set("bme280", "enabled", True)
+        txn.set("camera", "model", "imx219")
+
+Readers take a shared lock on the same file, so a reload never races with a
+detection run that is half-way through its updates.
+
+Author: BEAM Project
+"""
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+GLOBAL_DEFAULTS = {
+    "node_id": "unknown-node",
+    "base_dir": "/home/pi/data",
+    "ship_dir": "/home/pi/shipping",
+    "rollover_sec": 3600,
+    "timezone": "UTC",
+    "print_debug": True,
+    "sensor_mode": "inprocess",
+    "execution_mode": "pool",
+}
+
+RECORD_TYPES = {"ISO8601", "float", "int", "string", "bool"}
+GLOBAL_CHOICES = {
+    "sensor_mode": {"inprocess", "subprocess"},
+    "execution_mode": {"pool", "serial"},
+}
+NUMERIC_KEYS = ("frequency", "frequency_sec", "timeout_sec", "duration_sec",
+                "segment_sec", "duty_on_sec", "duty_off_sec", "ring_segments",
+                "preview_bins", "preview_width", "queue_size", "stats_interval_sec",
+                "pretrigger_frames", "pretrigger_fps", "verify_downscale", "verify_pixel_threshold",
+                "verify_min_ratio", "verify_frames", "verify_interval_sec",
+                "dedupe_window_sec", "dedupe_max_distance")
+
+
+class ConfigError(ValueError):
+    """Raised when config.json is unreadable or fails validation."""
+
+
+@contextmanager
+def file_lock(path, exclusive):
+    """Hold an flock on <path>.lock for the duration of the block."""
+    try:
+        lock_file = open(f"{path}.lock", "a")
+    except OSError:
+        # Read-only checkout: nobody can be writing, so run unlocked
+        yield
+        return
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# -----------------------------
+# Validation
+# -----------------------------
+def validate(cfg):
+    """Check the structure of a parsed config. Raises ConfigError on problems."""
+    if not isinstance(cfg, dict):
+        raise ConfigError("top level must be an object")
+
+    global_cfg = cfg.get("global", {})
+    if not isinstance(global_cfg, dict):
+        raise ConfigError("'global' must be an object")
+    for key, choices in GLOBAL_CHOICES.items():
+        if key in global_cfg and global_cfg[key] not in choices:
+            raise ConfigError(f"global.{key} must be one of {sorted(choices)}")
+
+    for name, params in cfg.items():
+        if name == "global":
+            continue
+        if not isinstance(params, dict):
+            raise ConfigError(f"'{name}' must be an object")
+        if "enabled" in params and not isinstance(params["enabled"], bool):
+            raise ConfigError(f"{name}.enabled must be true or false")
+        for key in NUMERIC_KEYS:
+            value = params.get(key)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+                raise ConfigError(f"{name}.{key} must be a non-negative number")
+        if "script_name" in params and not isinstance(params["script_name"], str):
+            raise ConfigError(f"{name}.script_name must be a string")
+
+        schema = params.get("record_schema")
+        if schema is not None:
+            if not isinstance(schema, dict) or not schema:
+                raise ConfigError(f"{name}.record_schema must be a non-empty object")
+            for field, kind in schema.items():
+                if kind not in RECORD_TYPES:
+                    raise ConfigError(f"{name}.record_schema.{field}: unknown type {kind!r}")
+    return cfg
+
+
+# -----------------------------
+# Cached config service
+# -----------------------------
+class ConfigService:
+    """Caches the parsed config.json keyed on its stat signature."""
+
+    def __init__(self, path=CONFIG_PATH, log=print):
+        self.path = path
+        self.log = log
+        self._lock = threading.Lock()
+        self._sig = None
+        self._cfg = None
+        self._callbacks = []
+
+    def _signature(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _refresh(self):
+        """Re-read the file if it changed. Returns True if a new config was loaded."""
+        try:
+            sig = self._signature()
+        except OSError as e:
+            if self._cfg is None:
+                raise ConfigError(f"cannot stat {self.path}: {e}")
+            return False
+        if sig == self._sig:
+            return False
+
+        try:
+            with file_lock(self.path, exclusive=False):
+                with open(self.path, "r") as f:
+                    cfg = validate(json.load(f))
+        except (OSError, json.JSONDecodeError, ConfigError) as e:
+            if self._cfg is None:
+                raise ConfigError(f"{self.path}: {e}")
+            self.log(f"[WARN] {self.path} invalid ({e}); keeping previous config")
+            self._sig = sig  # don't re-parse the same bad file on every call
+            return False
+
+        self._sig = sig
+        self._cfg = cfg
+        return True
+
+    def get(self):
+        """Return the current validated config (shared; do not mutate)."""
+        with self._lock:
+            self._refresh()
+            return self._cfg
+
+    def subscribe(self, callback):
+        """Register callback(cfg) to be called by check() when the file changes."""
+        self._callbacks.append(callback)
+
+    def check(self):
+        """Reload if config.json changed and notify subscribers. Returns True on change."""
+        with self._lock:
+            changed = self._refresh()
+            cfg = self._cfg
+        if changed:
+            for callback in self._callbacks:
+                callback(cfg)
+        return changed
+
+    def global_config(self):
+        """The "global" section with GLOBAL_DEFAULTS filled in."""
+        merged = dict(GLOBAL_DEFAULTS)
+        merged.update(self.get().get("global", {}))
+        return merged
+
+    def section(self, name):
+        """One sensor section, or {} if it does not exist."""
+        return self.get().get(name, {})
+
+
+# -----------------------------
+# Transactional writes
+# -----------------------------
+class ConfigTransaction:
+    """
+    Collects config.json updates in memory and commits them with one atomic
+    write. Nothing is locked while changes are staged (detection probes can
+    take seconds); commit() takes the exclusive lock, re-reads the current
+    file, applies the staged values and replaces the file only if something
+    actually changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.staged = {}  # (section, key) -> value, last write wins
+
+    def set(self, section, key, value):
+        """Stage one update."""
+        self.staged[(section, key)] = value
+
+    def commit(self):
+        """Apply staged updates under the lock. Returns True if the file was rewritten."""
+        with file_lock(self.path, exclusive=True):
+            try:
+                with open(self.path, "r") as f:
+                    cfg = json.load(f)
+            except Exception:
+                cfg = {}
+            if not isinstance(cfg, dict):
+                cfg = {}
+
+            changed = False
+            for (section, key), value in self.staged.items():
+                if section not in cfg or not isinstance(cfg[section], dict):
+                    cfg[section] = {}
+                if cfg[section].get(key) != value:
+                    cfg[section][key] = value
+                    changed = True
+            self.staged.clear()
+            if not changed:
+                return False
+
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cfg, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            return True
+
+
+@contextmanager
+def transaction(path=CONFIG_PATH):
+    """Stage config.json updates; commits them in one write on clean exit."""
+    txn = ConfigTransaction(path)
+    yield txn
+    txn.commit()
+
+
+_services = {}
+
+
+def service(path=CONFIG_PATH):
+    """Process-wide ConfigService for path."""
+    if path not in _services:
+        _services[path] = ConfigService(path)
+    return _services[path]
+
+
+def load(path=CONFIG_PATH):
+    return service(path).get()
+
+
+def global_config(path=CONFIG_PATH):
+    return service(path).global_config()
+
+
+def section(name, path=CONFIG_PATH):
+    return service(path).section(name)
@@ -0,0 +1,396 @@
+"""
+record_log.py: Append-only, crash-safe record log shared by the sensor loggers.
+
+Each sample is written as one framed line at the end of a JSON Lines file:
+
+    <crc32 as 8 hex digits> <compact JSON>\n
+
+Appending is O(1) no matter how many records the file already holds, and a
+power cut mid-write can only damage the last (torn) line. The first time a
+process opens a log, only the tail of the file is inspected and a torn or
+corrupt final frame is truncated away, so recovery cost does not grow with
+the size of the log. Later appends from the same process only check that
+the last byte is a newline and skip the scan if it is.
+
+The first frame of every log is a header carrying node_id and sensor so the
+compatibility exporter can rebuild the legacy document:
+
+    {"node_id": "...", "sensor": "...", "records": [...]}
+
+Logs are split into time-bucketed segments (hourly by default, see
+"rollover_sec" in config.json). Records for env_data.jsonl go to the
+segment of the current bucket,
+
+    env_data.20251020T140000Z.jsonl.active
+
+which is sealed by renaming it to env_data.20251020T140000Z.jsonl once its
+bucket has ended. Writers hold a shared lock on the directory's .segments.lock
+while appending and sealing takes it exclusively, so a sealed segment never
+changes again and shipping can rename it away at any time.
+
+Usage from the command line (the log is named by its base path; the export
+covers the unsegmented file and every segment still on the node):
+    python3 record_log.py export /home/pi/data/bme280/env_data.jsonl [out.json]
+
+Author: BEAM Project
+"""
+
+import json
+import os
+import re
+import sys
+import time
+import zlib
+from datetime import datetime, timezone
+
+from node_config import file_lock
+
+HEADER_KEY = "_log_header"
+TAIL_SCAN_BYTES = 64 * 1024
+ROLLOVER_SEC = 3600
+ACTIVE_SUFFIX = ".active"
+BUCKET_FORMAT = "%Y%m%dT%H%M%SZ"
+SEGMENT_RE = re.compile(r"^(?P<stem>.+)\.(?P<bucket>\d{8}T\d{6}Z)(?:-\d+)?(?P<ext>\.[^.]+)(?P<active>\.active)?$")
+
+
+# -----------------------------
+# Framing helpers
+# -----------------------------
+def encode_frame(obj):
+    """Return the framed bytes for one record (checksum + JSON + newline)."""
+    payload = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    crc = zlib.crc32(payload) & 0xFFFFFFFF
+    return b"%08x " % crc + payload + b"\n"
+
+
+def decode_frame(line):
+    """Decode one framed line. Returns the record, or None if the frame is bad."""
+    line = line.rstrip(b"\n")
+    if len(line) < 10 or line[8:9] != b" ":
+        return None
+    payload = line[9:]
+    try:
+        crc = int(line[:8], 16)
+    except ValueError:
+        return None
+    if zlib.crc32(payload) & 0xFFFFFFFF != crc:
+        return None
+    try:
+        return json.loads(payload.decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None
+
+
+# -----------------------------
+# Recovery
+# -----------------------------
+# Logs this process has already recovered (see RecordLog.__init__)
+_recovered = set()
+
+
+def ends_cleanly(path):
+    """True if the log is empty or its last byte ends a frame."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def recover_tail(path):
+    """
+    Truncate a torn or corrupt final frame left behind by a crash.
+
+    Only the last TAIL_SCAN_BYTES of the file are read. Returns the number of
+    bytes removed (0 if the log was already clean).
+    """
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+    if size == 0:
+        return 0
+
+    with open(path, "rb+") as f:
+        start = max(0, size - TAIL_SCAN_BYTES)
+        f.seek(start)
+        tail = f.read()
+
+        # Drop anything after the last newline (a partially written frame)
+        good_end = tail.rfind(b"\n") + 1
+        # Then drop the final complete frame too if its checksum does not match
+        while good_end > 0:
+            prev = tail.rfind(b"\n", 0, good_end - 1) + 1
+            if decode_frame(tail[prev:good_end]) is not None:
+                break
+            good_end = prev
+        if good_end == 0 and start > 0:
+            # Whole tail window unreadable; leave the file alone rather than
+            # guessing where the last good frame starts.
+            return 0
+
+        new_size = start + good_end
+        if new_size < size:
+            f.truncate(new_size)
+            f.flush()
+            os.fsync(f.fileno())
+        return size - new_size
+
+
+# -----------------------------
+# Record log
+# -----------------------------
+class RecordLog:
+    """Append-only JSON Lines record log with per-line CRC32 framing."""
+
+    def __init__(self, path, node_id=None, sensor=None, fsync=True):
+        self.path = path
+        self.node_id = node_id
+        self.sensor = sensor
+        self.fsync = fsync
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Full tail scan once per log and process; afterwards only if the
+        # last frame is visibly torn
+        key = os.path.abspath(path)
+        if key not in _recovered or not os.path.exists(path) or not ends_cleanly(path):
+            self.recovered_bytes = recover_tail(path)
+            _recovered.add(key)
+        else:
+            self.recovered_bytes = 0
+        self._f = open(path, "ab")
+        if self._f.tell() == 0:
+            self._write(encode_frame({HEADER_KEY: {"node_id": node_id, "sensor": sensor}}))
+
+    def _write(self, frame):
+        # A single write() of the whole frame keeps appends atomic with
+        # respect to other O_APPEND writers on the same file.
+        self._f.write(frame)
+        self._f.flush()
+        if self.fsync:
+            os.fsync(self._f.fileno())
+
+    def append(self, record):
+        """Append one record to the log."""
+        self._write(encode_frame(record))
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# -----------------------------
+# Time-bucketed segments
+# -----------------------------
+def segment_lock(directory, exclusive):
+    """Directory-wide lock: shared while appending, exclusive while sealing."""
+    return file_lock(os.path.join(directory, ".segments"), exclusive)
+
+
+def bucket_start(when, rollover_sec=ROLLOVER_SEC):
+    """Epoch seconds at which the bucket holding `when` begins."""
+    return int(when // rollover_sec * rollover_sec)
+
+
+def segment_path(path, when=None, rollover_sec=ROLLOVER_SEC):
+    """Active segment of the log at path for the bucket holding `when` (default: now)."""
+    when = time.time() if when is None else when
+    stamp = datetime.fromtimestamp(bucket_start(when, rollover_sec), timezone.utc).strftime(BUCKET_FORMAT)
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{stamp}{ext}{ACTIVE_SUFFIX}"
+
+
+def parse_segment(name):
+    """(stem, bucket epoch, ext, active) for a segment file name, or None."""
+    m = SEGMENT_RE.match(os.path.basename(name))
+    if m is None:
+        return None
+    bucket = datetime.strptime(m.group("bucket"), BUCKET_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+    return m.group("stem"), bucket, m.group("ext"), m.group("active") is not None
+
+
+def seal_segments(directory, now=None, rollover_sec=ROLLOVER_SEC):
+    """
+    Seal every active segment in directory whose bucket has ended by
+    renaming it without the .active suffix. Returns the sealed paths.
+    """
+    now = time.time() if now is None else now
+    sealed = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return sealed
+    with segment_lock(directory, exclusive=True):
+        for name in names:
+            info = parse_segment(name)
+            if info is None or not info[3] or info[1] + rollover_sec > now:
+                continue
+            src = os.path.join(directory, name)
+            dst = src[: -len(ACTIVE_SUFFIX)]
+            n = 0
+            while os.path.exists(dst):
+                # Same bucket sealed before (clock stepped back); never overwrite
+                n += 1
+                stem, _, ext, _ = info
+                stamp = datetime.fromtimestamp(info[1], timezone.utc).strftime(BUCKET_FORMAT)
+                dst = os.path.join(directory, f"{stem}.{stamp}-{n}{ext}")
+            try:
+                os.rename(src, dst)
+            except FileNotFoundError:
+                continue  # sealed by someone else meanwhile
+            sealed.append(dst)
+    return sealed
+
+
+def append_record(path, record, node_id=None, sensor=None, fsync=True, rollover_sec=ROLLOVER_SEC):
+    """
+    Append one record to the log at path. With rollover_sec > 0 (the
+    default) it goes to the current time-bucketed segment, and segments of
+    earlier buckets are sealed when a new one is started. rollover_sec=0
+    keeps the single, never-sealed file.
+    """
+    if not rollover_sec:
+        with RecordLog(path, node_id=node_id, sensor=sensor, fsync=fsync) as rec_log:
+            rec_log.append(record)
+        return
+
+    directory = os.path.dirname(path) or "."
+    if not os.path.exists(segment_path(path, None, rollover_sec)):
+        os.makedirs(directory, exist_ok=True)
+        seal_segments(directory, None, rollover_sec)
+    with segment_lock(directory, exclusive=False):
+        # Pick the bucket under the lock, so it cannot be sealed in between
+        active = segment_path(path, None, rollover_sec)
+        with RecordLog(active, node_id=node_id, sensor=sensor, fsync=fsync) as rec_log:
+            rec_log.append(record)
+
+
+def log_files(path):
+    """
+    [(bucket epoch or None, file)] for the log at base path: the unsegmented
+    file first if it exists, then its segments (sealed or active) by bucket.
+    """
+    directory = os.path.dirname(path) or "."
+    stem, ext = os.path.splitext(os.path.basename(path))
+    files = []
+    if os.path.exists(path):
+        files.append((None, path))
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return files
+    segments = []
+    for name in names:
+        info = parse_segment(name)
+        if info is not None and info[0] == stem and info[2] == ext:
+            segments.append((info[1], name))
+    files.extend((bucket, os.path.join(directory, name)) for bucket, name in sorted(segments))
+    return files
+
+
+def line_start_at(f, pos):
+    """Offset of the first frame starting at or after byte pos of the open log f."""
+    if pos == 0:
+        return 0
+    f.seek(pos - 1)
+    f.readline()
+    return f.tell()
+
+
+def first_offset_where(f, size, reached):
+    """
+    Offset of the first frame of the open log f (size bytes) for which
+    reached(record) is True, by bisection over byte offsets. Records must be
+    ordered so that reached() is False up to some point and True after it;
+    the header and corrupt frames count as not reached.
+    """
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = line_start_at(f, mid)
+        if start >= size:
+            hi = mid
+            continue
+        obj = decode_frame(f.readline())
+        if isinstance(obj, dict) and HEADER_KEY not in obj and reached(obj):
+            hi = mid
+        else:
+            lo = start + 1
+    return line_start_at(f, lo)
+
+
+def iter_frames(path):
+    """Yield every valid frame in the log, skipping corrupt lines."""
+    with open(path, "rb") as f:
+        for line in f:
+            obj = decode_frame(line)
+            if obj is not None:
+                yield obj
+
+
+def read_records(path):
+    """Return (header, records) for the log at path."""
+    header = {}
+    records = []
+    for obj in iter_frames(path):
+        if isinstance(obj, dict) and HEADER_KEY in obj:
+            header = obj[HEADER_KEY] or {}
+            continue
+        records.append(obj)
+    return header, records
+
+
+# -----------------------------
+# Compatibility exporter
+# -----------------------------
+def export_document(path, node_id=None, sensor=None):
+    """
+    Rebuild the legacy {"node_id", "sensor", "records"} document from the
+    log at base path, concatenating its segments in bucket order.
+    """
+    header = {}
+    records = []
+    with segment_lock(os.path.dirname(path) or ".", exclusive=False):  # no seal/ship mid-read
+        files = log_files(path)
+        if not files:
+            raise FileNotFoundError(f"no log or segments found for {path}")
+        for _, file_path in files:
+            file_header, file_records = read_records(file_path)
+            header = header or file_header
+            records.extend(file_records)
+    return {
+        "node_id": header.get("node_id", node_id),
+        "sensor": header.get("sensor", sensor),
+        "records": records,
+    }
+
+
+def export_json(path, out_path=None):
+    """Write the legacy JSON document next to the log (or to out_path)."""
+    if out_path is None:
+        out_path = os.path.splitext(path)[0] + ".json"
+    data = export_document(path)
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "export":
+        print("usage: record_log.py export <log.jsonl> [out.json]")
+        raise SystemExit(2)
+    out = export_json(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    print(f"Exported {sys.argv[2]} -> {out}")
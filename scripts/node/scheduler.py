@@ -4,11 +4,17 @@
 ###########################################################################################
 
 
-import json
+import heapq
+import math
 import os
 import subprocess
+import threading
 import time
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import node_config
+from sensor_host import SensorHost
 
 CONFIG_PATH = "/home/pi/BEAMNode_Prototype1/scripts/node/config.json"
 NODE_DIR = "/home/pi/BEAMNode_Prototype1/scripts/node/"
@@ -18,13 +24,16 @@ FILE_NAMES = {
 
 }
 
+log_lock = threading.Lock()
+
 # log funciton
 def log(msg):
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"[{ts}] {msg}"
-    with open(LOG_FILE, "a") as f:
-        f.write(line + "\n")
-    print(line)
+    with log_lock:  # sensor jobs log from worker threads
+        with open(LOG_FILE, "a") as f:
+            f.write(line + "\n")
+        print(line)
 
 # create /home/pi/data if it doesn't exist
 data_dir = "/home/pi/data"
@@ -34,23 +43,38 @@ os.makedirs(data_dir, exist_ok=True)
 shipping_dir = "/home/pi/shipping"
 os.makedirs(shipping_dir, exist_ok=True)
 
-# Track last run times
-last_run_times = {}
+# Longest single sleep, so edits to config.json are picked up while idle
+MAX_SLEEP_SEC = 60
+# A job starting later than this after its deadline is reported as late
+LATE_TOLERANCE_SEC = 2
+
+# Worker pool size when global.execution_mode is "pool" (the default)
+DEFAULT_MAX_WORKERS = 4
 
-# current time
-current_time = datetime.now()
+# Per-sensor run timeout unless config sets "timeout_sec"; recording
+# sensors get their "duration_sec" added on top
+DEFAULT_TIMEOUT_SEC = 60
+# Time a timed-out child gets between SIGTERM and SIGKILL
+KILL_GRACE_SEC = 5
 
-#beginning of next hour
-start_time = (current_time + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+# Circuit breaker defaults (override under "global" in config.json)
+DEFAULT_BREAKER_THRESHOLD = 3
+DEFAULT_BREAKER_BACKOFF_SEC = 60
+DEFAULT_BREAKER_MAX_BACKOFF_SEC = 3600
+
+# In-process sensor host (see sensor_host.py). Set "sensor_mode": "subprocess"
+# under "global" in config.json to go back to one interpreter per reading.
+sensor_host = SensorHost(log=log)
+
+# Shared cached view of config.json (re-parsed only when the file changes)
+config_service = node_config.ConfigService(CONFIG_PATH, log=log)
 
 def load_config():
-    """Load frequency configuration for all sensors."""
-    with open(CONFIG_PATH, "r") as f:
-        return json.load(f)
+    """Return the validated configuration for all sensors (cached on mtime)."""
+    return config_service.get()
 
-def find_sensor_script(sensor):
+def find_sensor_script(sensor, config):
     """Find the Python script inside each sensor’s directory."""
-    config = load_config()
     sensor_dir = os.path.join(NODE_DIR, sensor)
     params = config.get(sensor)
     if not os.path.isdir(sensor_dir):
@@ -65,59 +89,269 @@ def find_sensor_script(sensor):
     log(f"[WARN] No .py script found in '{sensor_dir}'")
     return None
 
+class CircuitBreaker:
+    """
+    Per-sensor circuit breaker. After `threshold` consecutive failures the
+    sensor is skipped for a backoff that doubles with each further failure
+    (capped at max_backoff), instead of being re-run every cycle.
+    """
+
+    def __init__(self, threshold, backoff, max_backoff):
+        self.configure(threshold, backoff, max_backoff)
+        self.failures = 0
+        self.open_until = 0.0
+
+    def configure(self, threshold, backoff, max_backoff):
+        """Apply new settings; the failure count and any open backoff are kept."""
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def allow(self, now):
+        return now >= self.open_until
+
+    def record(self, ok, now):
+        """Record a run's outcome. Returns the backoff in seconds if the breaker opened."""
+        if ok:
+            self.failures = 0
+            self.open_until = 0.0
+            return None
+        self.failures += 1
+        if self.failures < self.threshold:
+            return None
+        delay = min(self.backoff * 2 ** (self.failures - self.threshold), self.max_backoff)
+        self.open_until = now + delay
+        return delay
+
+breakers = {}
+
+def get_breaker(sensor, global_cfg):
+    """The sensor's breaker, with its settings taken from the current config."""
+    settings = (global_cfg.get("breaker_threshold", DEFAULT_BREAKER_THRESHOLD),
+                global_cfg.get("breaker_backoff_sec", DEFAULT_BREAKER_BACKOFF_SEC),
+                global_cfg.get("breaker_max_backoff_sec", DEFAULT_BREAKER_MAX_BACKOFF_SEC))
+    if sensor not in breakers:
+        breakers[sensor] = CircuitBreaker(*settings)
+    else:
+        breakers[sensor].configure(*settings)  # config.json may have changed since
+    return breakers[sensor]
+
+def sensor_timeout_sec(params):
+    """Per-sensor "timeout_sec", defaulting to DEFAULT_TIMEOUT_SEC plus any recording duration."""
+    if params.get("timeout_sec") is not None:
+        return float(params["timeout_sec"])
+    return DEFAULT_TIMEOUT_SEC + float(params.get("duration_sec", 0))
+
+def run_sensor_subprocess(sensor, script_path, timeout):
+    """
+    Run the sensor script as a child process, streaming its output line by
+    line into the log. On timeout the child is sent SIGTERM, then SIGKILL if
+    it has not exited after KILL_GRACE_SEC. Returns True on exit code 0.
+    """
+    proc = subprocess.Popen(["python3", "-u", script_path],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            text=True, bufsize=1)
+
+    def pump():
+        for line in proc.stdout:
+            log(f"[{sensor}] {line.rstrip()}")
+
+    reader = threading.Thread(target=pump, name=f"out-{sensor}", daemon=True)
+    reader.start()
+    try:
+        returncode = proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        log(f"[ERROR] {sensor} timed out after {timeout:g}s; terminating")
+        proc.terminate()
+        try:
+            proc.wait(timeout=KILL_GRACE_SEC)
+        except subprocess.TimeoutExpired:
+            log(f"[ERROR] {sensor} ignored SIGTERM; killing")
+            proc.kill()
+            proc.wait()
+        reader.join(KILL_GRACE_SEC)
+        return False
+
+    reader.join()
+    if returncode == 0:
+        return True
+    log(f"[ERROR] {sensor} exited with code {returncode}")
+    return False
+
 def run_sensor_once(sensor):
-    """Run the sensor’s Python script once."""
-    script_path = find_sensor_script(sensor)
+    """Take one reading, in-process when possible, else by running the script."""
+    config = load_config()
+    script_path = find_sensor_script(sensor, config)
     if not script_path:
-        return
+        return False
 
-    log(f"[INFO] Running {sensor} at {datetime.now().strftime('%H:%M:%S')}")
-    result = subprocess.run(["python3", script_path], capture_output=True, text=True)
+    global_cfg = config.get("global", {})
+    params = config.get(sensor, {})
 
-    # You can log result.stdout/result.stderr here if needed
-    if result.returncode == 0:
+    breaker = get_breaker(sensor, global_cfg)
+    if not breaker.allow(time.time()):
+        log(f"[WARN] {sensor} skipped: circuit open after {breaker.failures} consecutive failures")
+        return False
+
+    timeout = sensor_timeout_sec(params)
+    mode = global_cfg.get("sensor_mode", "inprocess")
+    if mode == "inprocess" and sensor_host.supports(sensor, script_path):
+        log(f"[INFO] Reading {sensor} in-process at {datetime.now().strftime('%H:%M:%S')}")
+        ok = sensor_host.read(sensor, script_path, config, timeout=timeout)
+    else:
+        log(f"[INFO] Running {sensor} at {datetime.now().strftime('%H:%M:%S')}")
+        ok = run_sensor_subprocess(sensor, script_path, timeout)
+
+    if ok:
         log(f"[INFO] {sensor} finished successfully.")
+    backoff = breaker.record(ok, time.time())
+    if backoff is not None:
+        log(f"[WARN] {sensor} failed {breaker.failures} times in a row; backing off {backoff:g}s")
+    return ok
+
+
+def sensor_period_sec(params):
+    """
+    Return a sensor's period in seconds, or None if it should not be scheduled.
+
+    "frequency" is in minutes and may be fractional (0.5 = every 30 s);
+    "frequency_sec" takes precedence when given.
+    """
+    if not isinstance(params, dict) or not params.get("enabled", True):
+        return None
+    if params.get("mode") == "continuous":
+        return None  # runs as its own long-lived service, not per reading
+    if params.get("frequency_sec") is not None:
+        period = float(params["frequency_sec"])
+    elif params.get("frequency") is not None:
+        period = float(params["frequency"]) * 60
     else:
-        log(f"[ERROR] {sensor} exited with code {result.returncode}")
-        log(result.stderr)
+        return None
+    return period if period > 0 else None
+
+def next_aligned_deadline(period, now):
+    """First multiple of period (counted from the epoch) strictly after now.
+
+    A 60 s period lands on :00 of every minute, 3600 s on the top of the hour.
+    """
+    return (math.floor(now / period) + 1) * period
 
+def build_schedule(config, now):
+    """Build the deadline heap: one (deadline, sensor, period) entry per sensor."""
+    heap = []
+    for sensor, params in config.items():
+        period = sensor_period_sec(params)
+        if period is None:
+            continue  # skip if disabled or no frequency defined
+        heapq.heappush(heap, (next_aligned_deadline(period, now), sensor, period))
+    return heap
 
+def sensor_bus(sensor, params):
+    """
+    Name of the bus a sensor sits on. Sensors sharing a bus never run at the
+    same time; sensors on different buses run in parallel in pool mode.
+    """
+    if params.get("bus"):
+        return params["bus"]
+    if "spi" in params:
+        return "spi"
+    if "i2c_bus" in params:
+        return f"i2c-{params.get('i2c_bus') or 1}"
+    if sensor == "audio":
+        return "usb"
+    return sensor
+
+bus_locks = {}
+bus_locks_guard = threading.Lock()
+
+def get_bus_lock(bus):
+    with bus_locks_guard:
+        if bus not in bus_locks:
+            bus_locks[bus] = threading.Lock()
+        return bus_locks[bus]
+
+def run_job(sensor, bus, deadline):
+    """Worker-thread body: wait for the sensor's bus, then take one reading."""
+    with get_bus_lock(bus):
+        queue_delay = time.time() - deadline
+        log(f"[INFO] {sensor} ({bus}) queue delay {queue_delay:.2f}s")
+        try:
+            run_sensor_once(sensor)
+        except Exception as e:
+            log(f"[ERROR] {sensor} job crashed: {e}")
 
 def scheduler_loop():
-    log("[INFO] Frequency-based Scheduler started")
-    config = load_config()
+    log("[INFO] Deadline-based Scheduler started")
+
+    schedule_key = None
+    heap = []
 
-    # Initialize last run times to "now" so they don't all start instantly
-    now = datetime.now()
-    for sensor in config.keys():
-        last_run_times[sensor] = now
+    # Pool mode: each sensor runs in a worker thread with at most one job in
+    # flight per sensor, so a 10 s audio clip no longer delays I2C/SPI reads.
+    global_cfg = load_config().get("global", {})
+    executor = None
+    running = {}  # sensor -> Future of its in-flight job
+    if global_cfg.get("execution_mode", "pool") == "pool":
+        workers = global_cfg.get("max_workers", DEFAULT_MAX_WORKERS)
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sensor")
+        log(f"[INFO] Running sensors in a pool of {workers} workers")
 
-    while True:
-        now = datetime.now()
-        config = load_config()  # reload in case user updates config.json
+    try:
+        while True:
+            # Cheap stat() check; only a real change to config.json reloads it
+            if config_service.check() or schedule_key is None:
+                config = load_config()
+                key = {sensor: sensor_period_sec(params) for sensor, params in config.items()}
+            # Rebuild the heap only when the set of periods actually changed
+            if key != schedule_key:
+                schedule_key = key
+                heap = build_schedule(config, time.time())
+                for deadline, sensor, period in sorted(heap):
+                    log(f"[INFO] {sensor}: every {period:g}s, next at "
+                        f"{datetime.fromtimestamp(deadline).strftime('%H:%M:%S')}")
+
+            if not heap:
+                time.sleep(MAX_SLEEP_SEC)
+                continue
+
+            # Sleep until the earliest deadline (capped so config edits are noticed)
+            deadline, sensor, period = heap[0]
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(min(delay, MAX_SLEEP_SEC))
+                continue
 
-        for sensor, params in config.items():
-            freq_min = params.get("frequency")
-            enabled = params.get("enabled", True)
-            if freq_min is None or not enabled:
-                continue  # skip if no frequency defined
-            last_run = last_run_times.get(sensor)
-            next_run = last_run + timedelta(minutes=freq_min)
+            heapq.heappop(heap)
+            lateness = time.time() - deadline
+            if lateness > LATE_TOLERANCE_SEC:
+                log(f"[WARN] {sensor} started {lateness:.1f}s after its deadline")
 
-            if now >= next_run:
+            if executor is None:
                 run_sensor_once(sensor)
-                last_run_times[sensor] = datetime.now()
-            time.sleep(1)  # brief sleep to avoid tight loop
-    
-                        
-        time.sleep(5)  # check every 5 seconds
+            elif sensor in running and not running[sensor].done():
+                log(f"[WARN] {sensor} still running; skipping this deadline")
+            else:
+                bus = sensor_bus(sensor, config.get(sensor, {}))
+                running[sensor] = executor.submit(run_job, sensor, bus, deadline)
+
+            # Next deadline is derived from the previous deadline, not from when
+            # the run finished, so the cadence never drifts by the sensor runtime.
+            next_deadline = deadline + period
+            now = time.time()
+            if next_deadline <= now:
+                missed = math.floor((now - next_deadline) / period) + 1
+                next_deadline += missed * period
+                log(f"[WARN] {sensor} missed {missed} deadline(s); next at "
+                    f"{datetime.fromtimestamp(next_deadline).strftime('%H:%M:%S')}")
+            heapq.heappush(heap, (next_deadline, sensor, period))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
 
 if __name__ == "__main__":
     try:
-        # wait until start time
-        log(f"[INFO] Scheduler will start at {start_time.strftime('%H:%M:%S')}")
-        while datetime.now() < start_time:
-            time.sleep(1)
         scheduler_loop()
     except KeyboardInterrupt:
         log("\n[INFO] Scheduler shutting down gracefully.")
+    finally:
+        sensor_host.close()
@@ -1,43 +1,49 @@
 #**** BEAM PROJECT - FRANCIS MARION UNIVERSITY - DETECT . PY ****#
-# This script is meant to use Python's subprocess module to 
-# scan SPI, I2C, Camera, and USB sensors and updates config.json
+# This script is meant to scan SPI, I2C, Camera, and USB sensors
+# and updates config.json
 # It should return text detailing which sensors are currently online.
 #
+# Probes live in a registry: each declares its bus and a timeout, and all
+# of them run concurrently. Hardware libraries are imported lazily by the
+# backend. The slow probes (camera, USB) are cached under a fingerprint of
+# the device nodes and USB devices, so a reboot with unchanged hardware skips
+# them; the fast bus probes (SPI, I2C) run every time, since swapping a bus
+# sensor changes neither. Run with
+#   --fake spec.json   to use a fake backend (no Pi hardware needed)
+#   --force            to ignore the detection cache
+#
 # Collaborators:
 # Alex Lance Jaylen Small
 #********************************************************************#
 
-import spidev
-import RPi.GPIO as GPIO
+import argparse
+import errno
+import fcntl
+import hashlib
 import subprocess
 import logging
 import logging.handlers
+import glob
 import re
 import os
+import threading
 import time
 import json
 import sys
-from picamera2 import Picamera2
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import node_config
 
 CONFIG_PATH = "/home/pi/BEAMNode_Prototype1/scripts/node/config.json"
+CACHE_PATH = os.path.join(os.path.dirname(CONFIG_PATH), "detect_cache.json")
 
 # ---------------- Config Helper ---------------- #
 
 def set_config_flag(path, section, key, value):
-    """Safely set a flag in config.json """
-    try:
-        with open(path, "r") as f:
-            cfg = json.load(f)
-    except Exception:
-        cfg = {}
-    if section not in cfg or not isinstance(cfg[section], dict):
-        cfg[section] = {}
-    if cfg[section].get(key) != value:
-        cfg[section][key] = value
-        tmp_path = f"{path}.tmp"
-        with open(tmp_path, "w") as f:
-            json.dump(cfg, f, indent=2)
-        os.replace(tmp_path, path)
+    """Safely set a single flag in config.json (one locked, atomic write)."""
+    with node_config.transaction(path) as txn:
+        txn.set(section, key, value)
 
 # ---------------- Logging Setup ---------------- #
 
@@ -73,140 +79,385 @@ if not spi_logger.handlers:
         spi_logger.addHandler(sh)
         print(f"[detect] Warning: file logging disabled ({e}). Using console handler.")
 
-# ---------------- SPI (BME/BMP280) ---------------- #
+# ---------------- I2C Bus Access ---------------- #
+
+I2C_SLAVE = 0x0703  # ioctl from <linux/i2c-dev.h>
+
+class I2CBus:
+    """
+    Direct access to /dev/i2c-N. probe() checks a single address by
+    selecting it and reading one byte (like `i2cdetect -r`), so only the
+    addresses we care about are touched and no sudo/subprocess is needed.
+    """
+
+    def __init__(self, busnum):
+        self.busnum = busnum
+        self.fd = os.open(f"/dev/i2c-{busnum}", os.O_RDWR)
+
+    def probe(self, addr):
+        try:
+            fcntl.ioctl(self.fd, I2C_SLAVE, addr)
+        except OSError as e:
+            # EBUSY: a kernel driver has claimed the address, so a device is there
+            return e.errno == errno.EBUSY
+        try:
+            os.read(self.fd, 1)
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FakeI2CBus:
+    """In-memory stand-in for I2CBus; `present` is the set of answering addresses."""
+
+    def __init__(self, busnum, present):
+        self.busnum = busnum
+        self.present = set(present)
+
+    def probe(self, addr):
+        return addr in self.present
+
+    def close(self):
+        pass
+
+# ---------------- Hardware Backends ---------------- #
 
 CS_PIN_BME = 5
 
-def spi_init(cs_pin):
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(cs_pin, GPIO.OUT, initial=GPIO.HIGH)
-    spi = spidev.SpiDev()
-    spi.open(0, 0)
-    spi.max_speed_hz = 1_000_000
-    spi.mode = 0
-    try:
-        spi.no_cs = True
-    except AttributeError:
-        spi_logger.warning("spidev.no_cs not available")
-    return spi
-
-def read_chip_ID(spi, reg, cs_pin):
-    GPIO.output(cs_pin, 0)
-    response = spi.xfer2([reg | 0x80, 0x00])[1]
-    GPIO.output(cs_pin, 1)
-    return response
-
-def detect_spi_sensor():
-    set_config_flag(CONFIG_PATH, "bme280", "enabled", False)
-    spi = spi_init(CS_PIN_BME)
-    try:
-        spi_logger.info("Starting BME/BMP280 detection")
-        chip1 = read_chip_ID(spi, 0xD0, CS_PIN_BME)
-        time.sleep(0.002)
-        chip2 = read_chip_ID(spi, 0xD0, CS_PIN_BME)
-        chip = chip1 if chip1 == chip2 else 0x00
-        if chip in (0x60, 0x58):
-            name = "BME280" if chip == 0x60 else "BMP280"
-            print(f"SPI Sensor Found: {name} (ID 0x{chip:02X})")
-            spi_logger.info(f"{name} detected (ID 0x{chip:02X})")
-            set_config_flag(CONFIG_PATH, "bme280", "enabled", True)
-            return name
-        else:
-            print(f"SPI Sensor: Unknown or not found (ID 0x{chip:02X})")
-            spi_logger.warning(f"Unexpected SPI chip ID 0x{chip:02X}")
-            return None
-    except Exception as e:
-        print("SPI Sensor detection failed")
-        spi_logger.exception("SPI detection failed")
-        return None
-    finally:
-        spi.close()
-        GPIO.cleanup()
-        spi_logger.info("SPI closed and GPIO cleaned up")
+class RealBackend:
+    """Talks to the Pi hardware. Hardware libraries are imported on first use."""
+
+    def spi_chip_id(self, cs_pin, reg=0xD0):
+        import spidev
+        import RPi.GPIO as GPIO
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(cs_pin, GPIO.OUT, initial=GPIO.HIGH)
+        spi = spidev.SpiDev()
+        spi.open(0, 0)
+        spi.max_speed_hz = 1_000_000
+        spi.mode = 0
+        try:
+            spi.no_cs = True
+        except AttributeError:
+            spi_logger.warning("spidev.no_cs not available")
+
+        def read_once():
+            GPIO.output(cs_pin, 0)
+            response = spi.xfer2([reg | 0x80, 0x00])[1]
+            GPIO.output(cs_pin, 1)
+            return response
+
+        try:
+            chip1 = read_once()
+            time.sleep(0.002)
+            chip2 = read_once()
+            return chip1 if chip1 == chip2 else 0x00
+        finally:
+            spi.close()
+            GPIO.cleanup()
+            spi_logger.info("SPI closed and GPIO cleaned up")
+
+    def camera_models(self):
+        from picamera2 import Picamera2
+        return [(c.get("Model") or c.get("model") or "").lower()
+                for c in Picamera2.global_camera_info()]
+
+    def i2c_bus_exists(self, bus):
+        return os.path.exists(f"/dev/i2c-{bus}")
+
+    def open_i2c(self, bus):
+        return I2CBus(bus)
+
+    def lsusb(self):
+        result = subprocess.run(["lsusb"], capture_output=True, text=True, check=True)
+        return result.stdout.splitlines()
+
+    def dev_nodes(self):
+        return sorted(glob.glob("/dev/i2c-*") + glob.glob("/dev/spidev*") + glob.glob("/dev/video*"))
+
+
+class FakeBackend:
+    """
+    Scripted hardware for running detection on a plain Linux box. The spec is
+    a dict (usually loaded from JSON), e.g.
+        {"spi_chip_id": 96, "cameras": ["imx219"], "i2c": {"1": [41, 56]},
+         "usb": ["Bus 001 Device 004: ID 16d0:06f3 AudioMoth"], "delay_sec": 0.5}
+    delay_sec is slept in every probe call to imitate slow hardware.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.delay = spec.get("delay_sec", 0)
+
+    def _wait(self):
+        if self.delay:
+            time.sleep(self.delay)
+
+    def spi_chip_id(self, cs_pin, reg=0xD0):
+        self._wait()
+        return self.spec.get("spi_chip_id", 0x00)
+
+    def camera_models(self):
+        self._wait()
+        return [m.lower() for m in self.spec.get("cameras", [])]
+
+    def i2c_bus_exists(self, bus):
+        return str(bus) in self.spec.get("i2c", {})
+
+    def open_i2c(self, bus):
+        self._wait()
+        addrs = self.spec.get("i2c", {}).get(str(bus), [])
+        return FakeI2CBus(bus, (int(a, 16) if isinstance(a, str) else a for a in addrs))
+
+    def lsusb(self):
+        self._wait()
+        return list(self.spec.get("usb", []))
+
+    def dev_nodes(self):
+        return sorted(f"/dev/i2c-{bus}" for bus in self.spec.get("i2c", {}))
+
+# ---------------- Probe Registry ---------------- #
+# A probe is fn(backend) -> {section: {key: value}} of config updates.
+# "fail" updates are applied when a probe raises or overruns its timeout.
+# "cached" probes are slow and their hardware shows up in the fingerprint;
+# the others are re-run on every boot.
+
+PROBES = []
+
+def probe(name, bus, timeout, fail, cached=False):
+    def register(fn):
+        PROBES.append({"name": name, "bus": bus, "timeout": timeout, "fn": fn, "fail": fail,
+                       "cached": cached})
+        return fn
+    return register
+
+# ---------------- SPI (BME/BMP280) ---------------- #
+
+@probe("bme280", bus="spi", timeout=5, fail={"bme280": {"enabled": False}})
+def detect_spi_sensor(backend):
+    spi_logger.info("Starting BME/BMP280 detection")
+    chip = backend.spi_chip_id(CS_PIN_BME)
+    if chip in (0x60, 0x58):
+        name = "BME280" if chip == 0x60 else "BMP280"
+        print(f"SPI Sensor Found: {name} (ID 0x{chip:02X})")
+        spi_logger.info(f"{name} detected (ID 0x{chip:02X})")
+        return {"bme280": {"enabled": True}}
+    print(f"SPI Sensor: Unknown or not found (ID 0x{chip:02X})")
+    spi_logger.warning(f"Unexpected SPI chip ID 0x{chip:02X}")
+    return {"bme280": {"enabled": False}}
 
 # ---------------- Camera (IMX219) ---------------- #
 
-def detect_camera():
+CAMERA_NOT_FOUND = {"camera": {"enabled": False, "model": None}}
+
+@probe("camera", bus="csi", timeout=15, fail=CAMERA_NOT_FOUND, cached=True)
+def detect_camera(backend):
     try:
-        cams = Picamera2.global_camera_info()
-        for c in cams:
-            model = (c.get("Model") or c.get("model") or "").lower()
+        for model in backend.camera_models():
             if "imx219" in model:
                 print("Camera Found: IMX219")
-                set_config_flag(CONFIG_PATH, "camera", "enabled", True)
-                set_config_flag(CONFIG_PATH, "camera", "model", "imx219")
-                return True
+                return {"camera": {"enabled": True, "model": "imx219"}}
     except Exception as e:
         spi_logger.warning(f"Camera detection failed: {e}")
     print("Camera Not Found")
-    set_config_flag(CONFIG_PATH, "camera", "enabled", False)
-    set_config_flag(CONFIG_PATH, "camera", "model", None)
-    return False
+    return CAMERA_NOT_FOUND
 
 # ---------------- I2C Sensors ---------------- #
 
 I2C_ADDR_TABLE = {"tsl2591": [0x29], "aht": [0x38]}
 CANDIDATE_I2C_BUSES = (1,)
 
-def scan_i2c(busnum):
+I2C_NOT_FOUND = {name: {"enabled": False, "i2c_bus": None, "address_hex": None} for name in I2C_ADDR_TABLE}
+
+def scan_i2c(backend, busnum, addrs):
+    """Probe only the given addresses on one bus. Returns the set that answered."""
+    try:
+        bus = backend.open_i2c(busnum)
+    except Exception as e:
+        spi_logger.warning(f"I2C open failed on bus {busnum}: {e}")
+        return set()
     try:
-        result = subprocess.run(["sudo", "i2cdetect", "-y", str(busnum)],
-                                capture_output=True, text=True, check=True)
-        return result.stdout
+        return set(addr for addr in addrs if bus.probe(addr))
     except Exception as e:
-        spi_logger.warning(f"I2C scan failed on bus {busnum}: {e}")
-        return ""
+        spi_logger.warning(f"I2C probe failed on bus {busnum}: {e}")
+        return set()
+    finally:
+        bus.close()
 
-def detect_i2c_sensors():
+@probe("i2c", bus="i2c", timeout=10, fail=I2C_NOT_FOUND)
+def detect_i2c_sensors(backend):
+    updates = {}
     detected = []
-    for bus in CANDIDATE_I2C_BUSES:
-        if not os.path.exists(f"/dev/i2c-{bus}"):
-            continue
-        output = scan_i2c(bus)
-        found_addrs = set(int(m, 16) for m in re.findall(r"\b[0-9a-f]{2}\b", output, re.IGNORECASE))
+    wanted = sorted(set(addr for addrs in I2C_ADDR_TABLE.values() for addr in addrs))
+    buses = [bus for bus in CANDIDATE_I2C_BUSES if backend.i2c_bus_exists(bus)]
+
+    # Each candidate bus is an independent adapter, so probe them in parallel
+    found_by_bus = {}
+    if buses:
+        with ThreadPoolExecutor(max_workers=len(buses)) as pool:
+            for bus, found in zip(buses, pool.map(lambda b: scan_i2c(backend, b, wanted), buses)):
+                found_by_bus[bus] = found
+
+    for bus in buses:
+        found_addrs = found_by_bus[bus]
 
         for name, addrs in I2C_ADDR_TABLE.items():
-            sensor_found = False
+            if name in detected:
+                continue
             for addr in addrs:
                 if addr in found_addrs:
                     print(f"I2C Sensor Found: {name} (Bus {bus}, Addr 0x{addr:02X})")
-                    set_config_flag(CONFIG_PATH, name, "enabled", True)
-                    set_config_flag(CONFIG_PATH, name, "i2c_bus", bus)
-                    set_config_flag(CONFIG_PATH, name, "address_hex", f"0x{addr:02X}")
+                    updates[name] = {"enabled": True, "i2c_bus": bus, "address_hex": f"0x{addr:02X}"}
                     detected.append(name)
-                    sensor_found = True
                     break
-            if not sensor_found:
-                set_config_flag(CONFIG_PATH, name, "enabled", False)
-                set_config_flag(CONFIG_PATH, name, "i2c_bus", None)
-                set_config_flag(CONFIG_PATH, name, "address_hex", None)
+    for name in I2C_ADDR_TABLE:
+        updates.setdefault(name, dict(I2C_NOT_FOUND[name]))
     if not detected:
         print("No I2C sensors detected")
-    return detected
+    return updates
 
 # ---------------- AudioMoth USB ---------------- #
 
-def detect_audiomoth():
+AUDIOMOTH_NOT_FOUND = {"audio": {"enabled": False, "mount_path": None}}
+
+@probe("audiomoth", bus="usb", timeout=5, fail=AUDIOMOTH_NOT_FOUND, cached=True)
+def detect_audiomoth(backend):
     try:
-        result = subprocess.run(["lsusb"], capture_output=True, text=True, check=True)
-        for line in result.stdout.splitlines():
+        for line in backend.lsusb():
             if "audiomoth" in line.lower():
                 print(f"AudioMoth USB Found: {line.strip()}")
-                set_config_flag(CONFIG_PATH, "audio", "enabled", True)
-                set_config_flag(CONFIG_PATH, "audio", "mount_path", None)
-                return True
+                return {"audio": {"enabled": True, "mount_path": None}}
     except Exception as e:
         spi_logger.warning(f"AudioMoth detection failed: {e}")
     print("AudioMoth USB Not Found")
-    set_config_flag(CONFIG_PATH, "audio", "enabled", False)
-    set_config_flag(CONFIG_PATH, "audio", "mount_path", None)
-    return False
+    return AUDIOMOTH_NOT_FOUND
+
+# ---------------- Runner ---------------- #
+
+def run_probes(backend, probes):
+    """
+    Run every probe in its own thread and wait for each up to its timeout
+    (measured from the common start). Returns (results, complete) where
+    complete is False if any probe failed or timed out.
+    """
+    results = {}
+    threads = []
+    for p in probes:
+        holder = {}
+
+        def target(p=p, holder=holder):
+            try:
+                holder["updates"] = p["fn"](backend)
+            except Exception as e:
+                holder["error"] = e
+
+        # Daemon threads: a wedged probe must not keep the process alive
+        t = threading.Thread(target=target, name=f"probe-{p['name']}", daemon=True)
+        t.start()
+        threads.append((p, t, holder))
+
+    start = time.monotonic()
+    complete = True
+    for p, t, holder in threads:
+        t.join(max(0.0, start + p["timeout"] - time.monotonic()))
+        if t.is_alive():
+            print(f"{p['name']} probe timed out after {p['timeout']}s ({p['bus']} bus)")
+            spi_logger.warning(f"{p['name']} probe timed out after {p['timeout']}s")
+            results[p["name"]] = p["fail"]
+            complete = False
+        elif "error" in holder:
+            print(f"{p['name']} detection failed")
+            spi_logger.error(f"{p['name']} probe failed: {holder['error']}")
+            results[p["name"]] = p["fail"]
+            complete = False
+        else:
+            results[p["name"]] = holder["updates"]
+    return results, complete
+
+# ---------------- Detection Cache ---------------- #
+
+def hardware_fingerprint(backend):
+    """Hash of the device nodes and USB device list present right now (covers the cached probes)."""
+    try:
+        usb = backend.lsusb()
+    except Exception:
+        usb = []
+    # Drop bus/device numbers, which change across replugs and reboots
+    usb = sorted(re.sub(r"^Bus \d+ Device \d+: ", "", line.strip()) for line in usb)
+    blob = json.dumps({"dev": backend.dev_nodes(), "usb": usb})
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+def load_cache(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def save_cache(path, fingerprint, results):
+    try:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"fingerprint": fingerprint, "results": results}, f, indent=2)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        spi_logger.warning(f"Could not save detection cache: {e}")
+
+def print_cached(name, updates):
+    """Summary line for a probe whose result came from the cache."""
+    for section, values in updates.items():
+        state = "online" if values.get("enabled") else "not found"
+        extra = f", model {values['model']}" if values.get("model") else ""
+        print(f"{section} ({name} probe): {state}{extra} (cached)")
 
 # ---------------- Main ---------------- #
 
-print("=== Sensor Detection Summary ===")
-detect_spi_sensor()
-detect_camera()
-detect_i2c_sensors()
-detect_audiomoth()
-print("=== Detection Complete ===")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect BEAM node sensors and update config.json")
+    parser.add_argument("--fake", metavar="SPEC", help="JSON spec for a fake hardware backend")
+    parser.add_argument("--force", action="store_true", help="ignore the detection cache")
+    parser.add_argument("--config", default=CONFIG_PATH, help="config.json to update")
+    parser.add_argument("--cache", default=CACHE_PATH, help="detection cache file")
+    args = parser.parse_args(argv)
+
+    if args.fake:
+        with open(args.fake, "r") as f:
+            backend = FakeBackend(json.load(f))
+    else:
+        backend = RealBackend()
+
+    start = time.monotonic()
+    print("=== Sensor Detection Summary ===")
+
+    fingerprint = hardware_fingerprint(backend)
+    cache = {} if args.force else load_cache(args.cache)
+    slow = [p for p in PROBES if p["cached"]]
+    cached = cache.get("results") or {}
+    if cache.get("fingerprint") == fingerprint and all(p["name"] in cached for p in slow):
+        print(f"Hardware unchanged (fingerprint {fingerprint[:12]}); using cached camera/USB results")
+        results, _ = run_probes(backend, [p for p in PROBES if not p["cached"]])
+        for p in slow:
+            results[p["name"]] = cached[p["name"]]
+            print_cached(p["name"], cached[p["name"]])
+    else:
+        results, complete = run_probes(backend, PROBES)
+        # Only cache a clean run, so a transient failure is re-probed next boot
+        if complete:
+            save_cache(args.cache, fingerprint, {p["name"]: results[p["name"]] for p in slow})
+
+    # All detection results are collected in one transaction and written to
+    # config.json with a single atomic replace when the block exits.
+    with node_config.transaction(args.config) as txn:
+        for p in PROBES:
+            for section, values in results.get(p["name"], {}).items():
+                for key, value in values.items():
+                    txn.set(section, key, value)
+
+    print(f"=== Detection Complete ({time.monotonic() - start:.2f}s) ===")
+
+if __name__ == "__main__":
+    main()
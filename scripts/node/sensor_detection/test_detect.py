@@ -0,0 +1,72 @@
+"""
+test_detect.py: Check detect.py against the fake hardware backend.
+
+Runs main(["--fake", ...]) on a scratch copy of config.json and checks:
+  - the second run with unchanged hardware takes camera/USB from the cache
+    and still prints their summary lines;
+  - a swapped I2C sensor is picked up on a cache hit (bus probes always run);
+  - I2CBus.probe() counts an address claimed by a kernel driver (EBUSY) as present.
+
+    python3 test_detect.py
+
+Author: BEAM Project
+"""
+
+import contextlib
+import errno
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import detect
+
+SPEC = {"spi_chip_id": 0x60, "cameras": ["imx219"], "i2c": {"1": ["0x29"]},
+        "usb": ["Bus 001 Device 004: ID 16d0:06f3 AudioMoth"]}
+
+
+def run_detect(directory, spec):
+    spec_path = os.path.join(directory, "spec.json")
+    with open(spec_path, "w") as f:
+        json.dump(spec, f)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        detect.main(["--fake", spec_path,
+                     "--config", os.path.join(directory, "config.json"),
+                     "--cache", os.path.join(directory, "detect_cache.json")])
+    with open(os.path.join(directory, "config.json"), "r") as f:
+        return out.getvalue(), json.load(f)
+
+
+with tempfile.TemporaryDirectory() as directory:
+    shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config.json"),
+                os.path.join(directory, "config.json"))
+
+    first, config = run_detect(directory, SPEC)
+    assert "Hardware unchanged" not in first, first
+    assert os.path.exists(os.path.join(directory, "detect_cache.json")), "clean run was not cached"
+    assert config["camera"]["enabled"] and config["audio"]["enabled"] and config["tsl2591"]["enabled"]
+
+    second, config = run_detect(directory, SPEC)
+    assert "Hardware unchanged" in second, second
+    assert "camera (camera probe): online, model imx219 (cached)" in second, second
+    assert "audio (audiomoth probe): online (cached)" in second, second
+    assert config["camera"]["enabled"] and config["audio"]["enabled"]
+
+    # Same device nodes, different sensor on the bus: still a cache hit
+    swapped, config = run_detect(directory, dict(SPEC, i2c={"1": ["0x38"]}))
+    assert "Hardware unchanged" in swapped, swapped
+    assert config["aht"]["enabled"] and not config["tsl2591"]["enabled"], "I2C swap not detected"
+
+bus = detect.I2CBus.__new__(detect.I2CBus)
+bus.busnum, bus.fd = 1, -1
+with mock.patch.object(detect.fcntl, "ioctl", side_effect=OSError(errno.EBUSY, "busy")):
+    assert bus.probe(0x38), "EBUSY address not reported as present"
+with mock.patch.object(detect.fcntl, "ioctl", side_effect=OSError(errno.ENXIO, "no device")):
+    assert not bus.probe(0x38)
+
+print("[BEAM] detect.py fake backend, cache and EBUSY checks passed")
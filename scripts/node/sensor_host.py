@@ -0,0 +1,133 @@
+"""
+sensor_host.py: Long-lived, in-process host for the BEAM sensor modules.
+
+Instead of starting a new python3 interpreter for every reading, the scheduler
+imports each sensor script once and keeps its bus handles and driver objects
+open across readings. A sensor script takes part by exposing three functions:
+
+    init(config)       -> ctx   open buses / drivers, return a context object
+    read(ctx, config)  -> rec   take one reading and log it
+    close(ctx)                  release whatever init() opened
+
+Scripts that do not expose this interface (or fail to import) are reported
+back to the caller, which falls back to running them as a subprocess.
+
+A thread cannot be killed, so a read that overruns its timeout is abandoned:
+the sensor is marked wedged and reported as unsupported (so the caller uses a
+killable subprocess) until the stuck read finally returns.
+
+Author: BEAM Project
+"""
+
+import importlib.util
+import os
+import sys
+import threading
+import traceback
+
+HOST_INTERFACE = ("init", "read", "close")
+
+
+class SensorHost:
+    """Caches one imported module and one open driver context per sensor."""
+
+    def __init__(self, log=print):
+        self.log = log
+        self.modules = {}    # sensor -> imported module (or None if unusable)
+        self.contexts = {}   # sensor -> ctx returned by module.init()
+        self.wedged = {}     # sensor -> thread still stuck in an overrun read
+
+    def _load_module(self, sensor, script_path):
+        if sensor in self.modules:
+            return self.modules[sensor]
+
+        module = None
+        try:
+            # Sensor scripts import siblings such as record_log from the node dir
+            sensor_dir = os.path.dirname(script_path)
+            node_dir = os.path.dirname(sensor_dir)
+            for path in (node_dir, sensor_dir):
+                if path not in sys.path:
+                    sys.path.insert(0, path)
+
+            spec = importlib.util.spec_from_file_location(f"beam_sensor_{sensor}", script_path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            if not all(callable(getattr(module, name, None)) for name in HOST_INTERFACE):
+                self.log(f"[INFO] {sensor}: no init/read/close interface, using subprocess mode")
+                module = None
+        except BaseException as e:
+            # SystemExit included: legacy scripts may exit at import time
+            self.log(f"[WARN] {sensor}: in-process import failed ({e!r}), using subprocess mode")
+            module = None
+
+        self.modules[sensor] = module
+        return module
+
+    def supports(self, sensor, script_path):
+        """True if the sensor can be run in-process right now."""
+        stuck = self.wedged.get(sensor)
+        if stuck is not None:
+            if stuck.is_alive():
+                return False
+            del self.wedged[sensor]
+            self.log(f"[INFO] {sensor}: overrun read returned, back to in-process mode")
+        return self._load_module(sensor, script_path) is not None
+
+    def _read(self, module, sensor, config, result):
+        try:
+            if sensor not in self.contexts:
+                self.contexts[sensor] = module.init(config)
+            module.read(self.contexts[sensor], config)
+            result.append(True)
+        except Exception as e:
+            self.log(f"[ERROR] {sensor} in-process read failed: {e}")
+            self.log(traceback.format_exc().rstrip())
+            self.reset(sensor)
+            result.append(False)
+
+    def read(self, sensor, script_path, config, timeout=None):
+        """
+        Take one reading in-process, initializing the driver on first use.
+
+        Returns True on success. On failure the driver is closed and dropped so
+        the next reading re-initializes it from scratch. If timeout (seconds)
+        expires first, the read is abandoned and the sensor marked wedged.
+        """
+        module = self._load_module(sensor, script_path)
+        if module is None:
+            return False
+
+        result = []
+        if timeout is None:
+            self._read(module, sensor, config, result)
+            return result[0]
+
+        worker = threading.Thread(target=self._read, args=(module, sensor, config, result),
+                                  name=f"read-{sensor}", daemon=True)
+        worker.start()
+        worker.join(timeout)
+        if worker.is_alive():
+            self.log(f"[ERROR] {sensor} in-process read timed out after {timeout}s; "
+                     f"using subprocess mode until it returns")
+            self.wedged[sensor] = worker
+            # The stuck thread still owns the driver; forget it without close()
+            self.contexts.pop(sensor, None)
+            return False
+        return result[0]
+
+    def reset(self, sensor):
+        """Close and forget the driver context for one sensor."""
+        ctx = self.contexts.pop(sensor, None)
+        module = self.modules.get(sensor)
+        if ctx is None or module is None:
+            return
+        try:
+            module.close(ctx)
+        except Exception as e:
+            self.log(f"[WARN] {sensor}: close failed: {e}")
+
+    def close(self):
+        """Close every open driver context."""
+        for sensor in list(self.contexts):
+            self.reset(sensor)
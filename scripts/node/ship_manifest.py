@@ -0,0 +1,208 @@
+"""
+ship_manifest.py: Sequenced manifest of everything placed in the shipping folder.
+
+Every file that lands in ship_dir (sealed segments and media moved by
+shipping.py, spectrogram previews) gets one manifest entry:
+
+    {"seq": 42, "path": "data-node1-20251020T150500Z/bme280/env_data....jsonl",
+     "size": 5120, "mtime": 1760972700.1, "sha256": "..."}
+
+"path" is relative to ship_dir. "seq" increases by one per entry and is
+never reused. The manifest lives next to the shipping folder (default
+<ship_dir>.manifest.jsonl, global "ship_manifest"), so pulls and cleanups of
+ship_dir never touch it. It uses the record_log.py framing.
+
+The supervisor keeps a per-node cursor (the last seq it has) and asks only
+for newer entries:
+
+    python3 ship_manifest.py since 41
+
+Entries are found by bisecting on seq over file offsets, so the cost of a
+listing grows with the amount of new data, not with the whole history.
+
+When the manifest is first created, everything already in ship_dir (e.g.
+data-* folders shipped before the manifest existed) is registered first, so
+it is pulled and acknowledged like anything shipped later.
+
+Once the supervisor has verified every file up to some seq, it confirms
+them and the node deletes exactly those files:
+
+    python3 ship_manifest.py ack 0 41
+
+Only files whose size, mtime and SHA-256 still match their entry are
+removed, so files moved in or rewritten during a transfer are never deleted
+unconfirmed.
+
+Author: BEAM Project
+"""
+
+import json
+import os
+import sys
+
+from node_config import file_lock
+from media_index import file_digest
+from record_log import HEADER_KEY, TAIL_SCAN_BYTES, RecordLog, decode_frame, first_offset_where
+
+
+def manifest_path(global_config):
+    """Manifest location for a node's global config."""
+    ship_dir = global_config.get("ship_dir", "/home/pi/shipping")
+    return global_config.get("ship_manifest") or f"{ship_dir.rstrip(os.sep)}.manifest.jsonl"
+
+
+def _entry(obj):
+    return obj if isinstance(obj, dict) and HEADER_KEY not in obj and "seq" in obj else None
+
+
+class ShipManifest:
+    """Append-only, sequenced manifest of files in ship_dir."""
+
+    def __init__(self, path, ship_dir, node_id=None):
+        self.path = path
+        self.ship_dir = ship_dir
+        self.node_id = node_id
+
+    def last_seq(self):
+        """Highest seq in the manifest (0 if empty), read from the tail only."""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+        with open(self.path, "rb") as f:
+            f.seek(max(0, size - TAIL_SCAN_BYTES))
+            for line in reversed(f.read().split(b"\n")):
+                entry = _entry(decode_frame(line))
+                if entry is not None:
+                    return entry["seq"]
+        return 0
+
+    def add(self, paths, checksums=None, final_paths=None):
+        """
+        Append entries for files in ship_dir. checksums may map a path to an
+        already known SHA-256 so the file is not read again. Files that are
+        still staged elsewhere pass final_paths, their locations once in
+        ship_dir. Returns the new entries.
+        """
+        checksums = checksums or {}
+        final_paths = final_paths or paths
+        entries = []
+        with file_lock(self.path, exclusive=True):
+            entries.extend(self._bootstrap(exclude=final_paths))
+            seq = self.last_seq()
+            with RecordLog(self.path, node_id=self.node_id, sensor="shipping") as rec_log:
+                for path, final_path in zip(paths, final_paths):
+                    st = os.stat(path)
+                    seq += 1
+                    entry = {
+                        "seq": seq,
+                        "path": os.path.relpath(final_path, self.ship_dir),
+                        "size": st.st_size,
+                        "mtime": st.st_mtime,
+                        "sha256": checksums.get(path) or file_digest(path),
+                    }
+                    rec_log.append(entry)
+                    entries.append(entry)
+        return entries
+
+    def _bootstrap(self, exclude=()):
+        """
+        If the manifest does not exist yet, register every file already in
+        ship_dir (other than those in exclude). Call with the lock held.
+        """
+        if os.path.exists(self.path):
+            return []
+        skip = {os.path.abspath(p) for p in exclude}
+        existing = sorted(
+            os.path.join(d, name) for d, _, names in os.walk(self.ship_dir) for name in names
+            if not name.endswith((".part", ".tmp")) and os.path.abspath(os.path.join(d, name)) not in skip)
+        entries = []
+        with RecordLog(self.path, node_id=self.node_id, sensor="shipping") as rec_log:
+            for seq, path in enumerate(existing, start=1):
+                st = os.stat(path)
+                entry = {"seq": seq, "path": os.path.relpath(path, self.ship_dir),
+                         "size": st.st_size, "mtime": st.st_mtime, "sha256": file_digest(path)}
+                rec_log.append(entry)
+                entries.append(entry)
+        return entries
+
+    def bootstrap(self):
+        """Create the manifest from ship_dir's current contents if it does not exist yet."""
+        with file_lock(self.path, exclusive=True):
+            return self._bootstrap()
+
+    def since(self, seq):
+        """Yield every entry with a seq greater than seq, in order."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(first_offset_where(f, size, lambda entry: _entry(entry) is not None and entry["seq"] > seq))
+            for line in f:
+                entry = _entry(decode_frame(line))
+                if entry is not None and entry["seq"] > seq:
+                    yield entry
+
+
+    def acknowledge(self, after_seq, upto_seq):
+        """
+        Delete the files of entries after_seq < seq <= upto_seq, which the
+        supervisor has verified, and prune folders left empty. A file is
+        hashed again before it is removed, so one rewritten in place with the
+        same size and mtime is kept. Returns (removed, kept): kept files no
+        longer match their entry.
+        """
+        removed = kept = 0
+        folders = set()
+        for entry in self.since(after_seq):
+            if entry["seq"] > upto_seq:
+                break
+            path = os.path.join(self.ship_dir, entry["path"])
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue  # already acknowledged
+            if (st.st_size != entry["size"] or st.st_mtime != entry["mtime"]
+                    or file_digest(path) != entry["sha256"]):
+                kept += 1
+                continue
+            os.remove(path)
+            removed += 1
+            folders.add(os.path.dirname(path))
+
+        root = os.path.abspath(self.ship_dir)
+        for folder in sorted(folders, key=len, reverse=True):
+            folder = os.path.abspath(folder)
+            while folder != root and folder.startswith(root + os.sep):
+                try:
+                    os.rmdir(folder)
+                except OSError:
+                    break  # not empty
+                folder = os.path.dirname(folder)
+        return removed, kept
+
+
+def for_node():
+    """ShipManifest for this node's config.json."""
+    import node_config
+    global_config = node_config.global_config()
+    return ShipManifest(manifest_path(global_config), global_config.get("ship_dir", "/home/pi/shipping"),
+                        node_id=global_config.get("node_id"))
+
+
+if __name__ == "__main__":
+    usage = ("usage: ship_manifest.py since <seq>\n"
+             "       ship_manifest.py ack <after_seq> <upto_seq>")
+    if len(sys.argv) == 3 and sys.argv[1] == "since":
+        manifest = for_node()
+        manifest.bootstrap()
+        for entry in manifest.since(int(sys.argv[2])):
+            print(json.dumps(entry, separators=(",", ":")))
+    elif len(sys.argv) == 4 and sys.argv[1] == "ack":
+        removed, kept = for_node().acknowledge(int(sys.argv[2]), int(sys.argv[3]))
+        print(json.dumps({"removed": removed, "kept": kept}))
+    else:
+        print(usage)
+        raise SystemExit(2)
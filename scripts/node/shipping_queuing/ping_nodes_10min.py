@@ -8,6 +8,8 @@ sys.path.insert(0, str(VENDOR_DIR))
 import subprocess
 import os
 import json
+import fcntl
+import time
 from datetime import datetime
 
 JSON_FILEPATH = "/home/pi/BEAMNode_Prototype1/scripts/node/shipping_queuing/node_states.json"
@@ -46,6 +48,7 @@ def main():
     log("=== 10-MINUTE PING CHECK START ===")
 
     changed = False
+    seen = {}
 
     for name, info in nodes.items():
         ip = info["ip"]
@@ -55,6 +58,9 @@ def main():
 
         if latency is not None:
             log(f"Node {name} ({ip}) alive, latency {latency:.2f} ms")
+            # retryqueue.py retries a backed-off node as soon as it has been seen
+            seen[name] = time.time()
+            changed = True
             if current_state != "alive":
                 log(f"Node {name} transitioned to ALIVE at this time.")
                 nodes[name]["node_state"] = "alive"
@@ -67,8 +73,21 @@ def main():
                 changed = True
 
     if changed:
-        with open(JSON_FILEPATH, "w") as f:
-            json.dump(nodes, f, indent=4)
+        # retryqueue.py may have updated the file while we were pinging:
+        # re-read it under the shared lock and write back only our fields
+        with open(f"{JSON_FILEPATH}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with open(JSON_FILEPATH, "r") as f:
+                current = json.load(f)
+            for name, info in nodes.items():
+                if name in current:
+                    current[name]["node_state"] = info.get("node_state", "unknown")
+                    if name in seen:
+                        current[name]["last_seen"] = seen[name]
+            tmp_path = f"{JSON_FILEPATH}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(current, f, indent=4)
+            os.replace(tmp_path, JSON_FILEPATH)
 
     log("=== 10-MINUTE PING CHECK END ===")
 
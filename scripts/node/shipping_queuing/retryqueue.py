@@ -3,6 +3,55 @@
 retryqueue.py: Requests and queues data from nodes via mDNS.
 Path: /home/pi/shipping (on node) ==> /home/pi/data (on supervisor)
 
+Nodes are handled in parallel. All nodes are pinged at once. Listing, pull
+and cleanup for up to MAX_PARALLEL nodes run concurrently in a thread pool.
+Of the nodes that reach the supervisor through the same mesh neighbour (the
+optional "via" field in node_states.json), at most MAX_PER_HOP are started
+at a time, so a weak relay is not flooded; free workers meanwhile go to
+nodes behind other hops. At the end, the run's wall-clock time is
+logged next to the summed per-node time.
+
+All SSH traffic to a node (listing, rsync, cleanup, retries) is multiplexed
+over one ControlMaster connection that is opened on first use. It is
+health-checked before every node pass and closed when the run ends, so the
+key exchange over the mesh happens once per node per run.
+
+Pulls are delta syncs driven by the node's shipping manifest (see
+scripts/node/ship_manifest.py). The supervisor keeps a per-node cursor
+("manifest_seq" in node_states.json), asks the node only for entries past
+it, transfers exactly those files with rsync --files-from and checks each
+one's size and SHA-256. The cursor then moves up to the last entry that has
+been verified with no gaps before it. Nodes without the manifest tool are
+pulled the old way (whole shipping folder).
+
+Nothing is deleted on a node until it has been confirmed. The supervisor
+acknowledges the verified range ("acked_seq" up to "manifest_seq"), and the
+node removes only those files, and only if they are unchanged since they
+were registered. An interrupted rsync leaves its partial file in
+.rsync-partial/ and resumes from it. Files already verified on the
+supervisor are never requested again.
+
+Retries are scheduled per node, not run as back-to-back rounds. Each node
+entry in node_states.json carries a small state machine that survives
+restarts:
+
+    idle -> probing -> transferring -> idle
+                \            \
+                 +-> backoff <-+        (exponential, with jitter)
+                        |
+                        +-> quarantined (after QUARANTINE_AFTER failures)
+
+A run sleeps until the next node is due. It ends once every node has been
+transferred, or once RUN_WINDOW_SEC has passed. It also ends early when no
+remaining node can become due inside the window: every next attempt lies
+beyond it and none of the nodes failed for being offline (those can be
+woken by the ping monitor, see below). Nodes still backing off are picked
+up by the next run. Quarantined nodes are only probed every QUARANTINE_PROBE_SEC.
+A node that failed because it was offline is due right away once the
+10-minute ping monitor (ping_nodes_10min.py) has seen it since its last
+attempt, so a node that comes back in range costs no extra probing. Nodes
+that answer ping but fail to transfer always wait out their backoff.
+
 Author: Gabriel Gonzalez, Noel Challa, Alex Lance, Jackson Roberts, and Jaylen Small
 Last Updated: 2-6-26 
 """
@@ -11,20 +60,44 @@ import sys
 import subprocess
 import os
 import json
+import fcntl
+import random
+import signal
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from pathlib import Path
 
+# Shared helpers from the node scripts (same checkout on the supervisor)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from media_index import file_digest
+
 # ---------------------------------------------------
 # CONFIGURATION
 # ---------------------------------------------------
 JSON_FILEPATH = "/home/pi/BEAMNode_Prototype1/scripts/node/shipping_queuing/node_states.json"
 SUPERVISOR_DATA_ROOT = "/home/pi/data"
 REMOTE_SHIP_DIR = "/home/pi/shipping"
+REMOTE_MANIFEST_TOOL = "/home/pi/BEAMNode_Prototype1/scripts/node/ship_manifest.py"
+RSYNC_PARTIAL_DIR = ".rsync-partial"  # per destination folder, on the supervisor
 LOG_FILE = "/home/pi/logs/queue.log"
 
-MAX_RETRIES = 5
 PING_COUNT = 1
 
+# Per-node retry scheduling (see the state machine above)
+BACKOFF_BASE_SEC = 60          # first retry after 30-60 s
+BACKOFF_MAX_SEC = 3600         # backoff ceiling
+QUARANTINE_AFTER = 8           # consecutive failures before quarantine
+QUARANTINE_PROBE_SEC = 6 * 3600
+RUN_WINDOW_SEC = 3 * 3600      # longest a run waits for nodes that are backing off
+STATE_POLL_SEC = 60            # how often a sleeping run re-reads node_states.json
+
+MAX_PARALLEL = 4   # nodes transferring at the same time
+MAX_PER_HOP = 2    # transfers sharing one mesh neighbour ("via"); None = no limit
+
 # SSH options to force non-interactive mode and bypass prompts
 SSH_OPTS = [
     "-o", "BatchMode=yes",
@@ -32,20 +105,43 @@ SSH_OPTS = [
     "-o", "StrictHostKeyChecking=accept-new"
 ]
 
+# Control sockets for the per-node master connections (kept short: socket
+# paths are limited to ~100 characters)
+SSH_CONTROL_DIR = "/tmp/beam-ssh"
+
 # ---------------------------------------------------
 # LOGGING
 # ---------------------------------------------------
+_log_lock = threading.Lock()
+
 def log(msg):
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"[{ts}] {msg}"
-    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
-    with open(LOG_FILE, "a") as f:
-        f.write(line + "\n")
-    print(line)
+    with _log_lock:
+        os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+        with open(LOG_FILE, "a") as f:
+            f.write(line + "\n")
+        print(line)
 
 # ---------------------------------------------------
 # LOAD/SAVE NODE STATE
 # ---------------------------------------------------
+# ping_nodes_10min.py updates the same file; fields it owns are never
+# overwritten from this process's (possibly older) copy
+PING_MONITOR_KEYS = ("last_seen",)
+
+class state_lock:
+    """Exclusive lock shared with ping_nodes_10min.py for read-modify-write of node_states.json."""
+
+    def __enter__(self):
+        self.f = open(f"{JSON_FILEPATH}.lock", "a")
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
 def load_nodes():
     if not os.path.exists(JSON_FILEPATH):
         log(f"ERROR: node state file missing: {JSON_FILEPATH}")
@@ -58,12 +154,32 @@ def load_nodes():
         return {}
 
 def save_nodes(nodes):
+    """Write node state back, keeping fields the ping monitor has updated meanwhile."""
     try:
-        with open(JSON_FILEPATH, "w") as f:
-            json.dump(nodes, f, indent=4)
+        with state_lock():
+            current = load_nodes() if os.path.exists(JSON_FILEPATH) else {}
+            for name, info in nodes.items():
+                merged = dict(info)
+                for key in PING_MONITOR_KEYS:
+                    if key in current.get(name, {}):
+                        merged[key] = current[name][key]
+                current[name] = merged
+            tmp_path = f"{JSON_FILEPATH}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(current, f, indent=4)
+            os.replace(tmp_path, JSON_FILEPATH)
     except Exception as e:
         log(f"ERROR: Could not save JSON: {e}")
 
+def refresh_ping_monitor(nodes):
+    """Pick up what the ping monitor has recorded since the run started."""
+    with state_lock():
+        current = load_nodes()
+    for name, info in nodes.items():
+        for key in PING_MONITOR_KEYS:
+            if key in current.get(name, {}):
+                info[key] = current[name][key]
+
 # ---------------------------------------------------
 # NETWORK & DATA OPERATIONS
 # ---------------------------------------------------
@@ -83,10 +199,81 @@ def ping_node(full_hostname):
     except:
         return False
 
+# ---------------------------------------------------
+# SSH CONNECTION POOL
+# ---------------------------------------------------
+class SSHMasters:
+    """
+    One multiplexed SSH master connection per node.
+
+    ssh_opts(host) returns options that route a command through the node's
+    master. If no master is up, ssh falls back to a direct connection on its
+    own, so commands work either way.
+    """
+
+    def __init__(self, control_dir=SSH_CONTROL_DIR):
+        self.control_dir = control_dir
+        self.locks = defaultdict(threading.Lock)
+        self.opened = set()
+
+    def socket_path(self, full_hostname):
+        return os.path.join(self.control_dir, f"{full_hostname}.sock")
+
+    def ssh_opts(self, full_hostname):
+        return SSH_OPTS + ["-o", f"ControlPath={self.socket_path(full_hostname)}", "-o", "ControlMaster=no"]
+
+    def rsync_shell(self, full_hostname):
+        """Value for rsync -e."""
+        return "ssh " + " ".join(self.ssh_opts(full_hostname))
+
+    def _control(self, full_hostname, command):
+        return subprocess.run(
+            ["ssh", "-o", f"ControlPath={self.socket_path(full_hostname)}", "-O", command, f"pi@{full_hostname}"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ).returncode == 0
+
+    def check(self, full_hostname):
+        """True if the node's master connection is up and answering."""
+        return os.path.exists(self.socket_path(full_hostname)) and self._control(full_hostname, "check")
+
+    def ensure(self, full_hostname):
+        """Health-check the node's master and (re)open it if needed. Returns True if it is up."""
+        with self.locks[full_hostname]:
+            if self.check(full_hostname):
+                return True
+            os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+            try:
+                os.remove(self.socket_path(full_hostname))  # stale socket from a dead master
+            except FileNotFoundError:
+                pass
+            cmd = ["ssh"] + SSH_OPTS + [
+                "-o", "ControlMaster=yes",
+                "-o", f"ControlPath={self.socket_path(full_hostname)}",
+                "-o", "ControlPersist=yes",
+                "-o", "ServerAliveInterval=10",
+                "-o", "ServerAliveCountMax=3",
+                "-N", "-f", f"pi@{full_hostname}"
+            ]
+            try:
+                subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30, check=True)
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+                log(f"{full_hostname}: WARNING - could not open SSH master, using direct connections")
+                return False
+            self.opened.add(full_hostname)
+            return True
+
+    def close_all(self):
+        """Tear down every master opened during this run."""
+        for full_hostname in sorted(self.opened):
+            self._control(full_hostname, "exit")
+        self.opened.clear()
+
+masters = SSHMasters()
+
 def has_remote_data(full_hostname):
     """Lists remote files to verify presence of data."""
     remote_path = f"pi@{full_hostname}:{REMOTE_SHIP_DIR}/"
-    cmd = ["rsync", "--list-only", "-e", f"ssh {' '.join(SSH_OPTS)}", remote_path]
+    cmd = ["rsync", "--list-only", "-e", masters.rsync_shell(full_hostname), remote_path]
     try:
         result = subprocess.run(cmd, capture_output=True, text=True, check=True)
 
@@ -114,7 +301,7 @@ def rsync_pull(full_hostname):
     remote_source = f"pi@{full_hostname}:{REMOTE_SHIP_DIR}/"
     cmd = [
         "rsync", "-avz", "--partial", "--ignore-existing",
-        "-e", f"ssh {' '.join(SSH_OPTS)}",
+        "-e", masters.rsync_shell(full_hostname),
         remote_source, SUPERVISOR_DATA_ROOT
     ]
     try:
@@ -123,9 +310,131 @@ def rsync_pull(full_hostname):
     except subprocess.CalledProcessError:
         return False
 
+# ---------------------------------------------------
+# MANIFEST DELTA SYNC
+# ---------------------------------------------------
+def has_manifest_tool(full_hostname):
+    """
+    True if the node has ship_manifest.py, False only if the file is
+    definitely missing. Raises CalledProcessError if the check itself fails.
+    """
+    cmd = ["ssh"] + masters.ssh_opts(full_hostname) + [f"pi@{full_hostname}", f"test -f {REMOTE_MANIFEST_TOOL}"]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode in (0, 1):
+        return result.returncode == 0
+    raise subprocess.CalledProcessError(result.returncode, cmd, result.stdout, result.stderr)
+
+def fetch_manifest(full_hostname, cursor):
+    """
+    Manifest entries past cursor, in seq order. Raises CalledProcessError if
+    the listing fails for any reason (unreachable node, bad config.json,
+    unreadable manifest) and ValueError if its output cannot be parsed.
+    """
+    cmd = ["ssh"] + masters.ssh_opts(full_hostname) + [
+        f"pi@{full_hostname}", f"python3 {REMOTE_MANIFEST_TOOL} since {int(cursor)}"]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    entries = [json.loads(line) for line in result.stdout.splitlines() if line.strip()]
+    return sorted(entries, key=lambda e: e["seq"])
+
+def pull_manifest_files(full_hostname, entries):
+    """Pulls exactly the files listed in entries (paths relative to the shipping folder)."""
+    os.makedirs(SUPERVISOR_DATA_ROOT, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", prefix="beam-files-", suffix=".txt") as file_list:
+        file_list.write("".join(f"{entry['path']}\n" for entry in entries))
+        file_list.flush()
+        cmd = [
+            # Partial files stay out of the verified tree and are resumed on the next pass
+            "rsync", "-avz", "--partial", f"--partial-dir={RSYNC_PARTIAL_DIR}", "--ignore-missing-args",
+            f"--files-from={file_list.name}",
+            "-e", masters.rsync_shell(full_hostname),
+            f"pi@{full_hostname}:{REMOTE_SHIP_DIR}/", SUPERVISOR_DATA_ROOT
+        ]
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+def verify_entry(entry):
+    """'ok', 'missing' or 'bad' for the local copy of a manifest entry."""
+    path = os.path.join(SUPERVISOR_DATA_ROOT, entry["path"])
+    if not os.path.isfile(path):
+        return "missing"
+    if os.path.getsize(path) != entry["size"] or file_digest(path) != entry["sha256"]:
+        return "bad"
+    return "ok"
+
+def advance_cursor(full_hostname, entries, cursor, pulled, states):
+    """
+    Verify the pulled entries (states holds results already known by seq).
+    Returns (new cursor, complete): the cursor stops before the first entry
+    that is not verified. A file missing after a clean rsync is no longer on
+    the node and does not hold the cursor back.
+    """
+    complete = True
+    for entry in entries:
+        state = states.get(entry["seq"]) or verify_entry(entry)
+        if state == "missing" and pulled:
+            log(f"{full_hostname}: WARNING - {entry['path']} (seq {entry['seq']}) is no longer on the node")
+        elif state != "ok":
+            if state == "bad":
+                log(f"{full_hostname}: WARNING - checksum mismatch for {entry['path']}, will pull again")
+                os.remove(os.path.join(SUPERVISOR_DATA_ROOT, entry["path"]))
+            complete = False
+        if complete:
+            cursor = entry["seq"]
+    return cursor, complete
+
+def acknowledge(full_hostname, after_seq, upto_seq):
+    """Confirms verified entries after_seq < seq <= upto_seq so the node deletes those files."""
+    cmd = ["ssh"] + masters.ssh_opts(full_hostname) + [
+        f"pi@{full_hostname}", f"python3 {REMOTE_MANIFEST_TOOL} ack {int(after_seq)} {int(upto_seq)}"]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        counts = json.loads(result.stdout)
+    except (subprocess.CalledProcessError, ValueError):
+        log(f"{full_hostname}: WARNING - acknowledgement of seq {after_seq + 1}-{upto_seq} failed, will resend")
+        return False
+    log(f"{full_hostname}: Acknowledged seq {after_seq + 1}-{upto_seq}: "
+        f"{counts['removed']} file(s) removed on node, {counts['kept']} changed and kept")
+    return True
+
+def sync_manifest(full_hostname, info, entries, retry=False):
+    """
+    Pull, verify and acknowledge the manifest entries past info's cursor.
+    Returns True when everything listed has been verified.
+    """
+    cursor = info.get("manifest_seq", 0)
+    ok = True
+    if entries:
+        # Files verified on an earlier pass (beyond a gap) are not requested again
+        states = {entry["seq"]: verify_entry(entry) for entry in entries}
+        wanted = [entry for entry in entries if states[entry["seq"]] != "ok"]
+        size = sum(entry["size"] for entry in wanted)
+        log(f"{full_hostname}: Pulling {len(wanted)} file(s), {size / 1e6:.1f} MB "
+            f"(seq {entries[0]['seq']}-{entries[-1]['seq']})...")
+        pulled = pull_manifest_files(full_hostname, wanted) if wanted else True
+        for entry in wanted:
+            del states[entry["seq"]]  # check again after the pull
+        info["manifest_seq"], ok = advance_cursor(full_hostname, entries, cursor, pulled, states)
+        ok = ok and pulled
+        if ok:
+            log(f"{full_hostname}: {'SUCCESS on retry' if retry else 'TRANSFER SUCCESS'} "
+                f"(manifest seq {info['manifest_seq']})")
+        else:
+            log(f"{full_hostname}: TRANSFER FAILURE (verified up to seq {info['manifest_seq']})")
+    else:
+        log(f"{full_hostname}: Up to date (manifest seq {cursor})")
+
+    # Confirm the verified range; a failed acknowledgement is resent next pass
+    acked = info.get("acked_seq", 0)
+    if info.get("manifest_seq", 0) > acked and acknowledge(full_hostname, acked, info["manifest_seq"]):
+        info["acked_seq"] = info["manifest_seq"]
+    return ok
+
 def delete_shipping_data(full_hostname):
-    """Removes data from node shipping folder after successful pull."""
-    cmd = ["ssh"] + SSH_OPTS + [f"pi@{full_hostname}", f"sudo rm -rf {REMOTE_SHIP_DIR}/*"]
+    """Removes data from node shipping folder after successful pull (nodes without a manifest only)."""
+    cmd = ["ssh"] + masters.ssh_opts(full_hostname) + [f"pi@{full_hostname}", f"sudo rm -rf {REMOTE_SHIP_DIR}/*"]
     try:
         subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         log(f"{full_hostname}: Remote folder cleared.")
@@ -134,67 +443,206 @@ def delete_shipping_data(full_hostname):
         log(f"{full_hostname}: WARNING - Failed to clear remote data.")
         return False
 
+# ---------------------------------------------------
+# PARALLEL TRANSFER ENGINE
+# ---------------------------------------------------
+def transfer_node(name, info, retry=False):
+    """
+    Listing, pull and cleanup for one alive node.
+    Returns (name, ok, elapsed_sec); ok is True when nothing is left to pull.
+    """
+    start = time.monotonic()
+    full_host = get_full_host(name, info)
+    masters.ensure(full_host)
+    # Only a node that definitely lacks the manifest tool may use the old
+    # pull + rm -rf; any other manifest problem is a transfer failure
+    try:
+        entries = fetch_manifest(full_host, info.get("manifest_seq", 0)) if has_manifest_tool(full_host) else None
+    except (subprocess.CalledProcessError, ValueError, KeyError) as e:
+        detail = (getattr(e, "stderr", None) or str(e)).strip().splitlines()
+        log(f"{full_host}: TRANSFER FAILURE (manifest listing failed: {detail[-1] if detail else e})")
+        return name, False, time.monotonic() - start
+    if entries is not None:
+        return name, sync_manifest(full_host, info, entries, retry), time.monotonic() - start
+
+    # Node without a manifest tool: pull the whole shipping folder
+    if not has_remote_data(full_host):
+        log(f"{full_host}: No files found in {REMOTE_SHIP_DIR}/")
+        return name, True, time.monotonic() - start
+
+    log(f"{full_host}: Pulling data...")
+    if rsync_pull(full_host):
+        log(f"{full_host}: {'SUCCESS on retry' if retry else 'TRANSFER SUCCESS'}")
+        delete_shipping_data(full_host)
+        return name, True, time.monotonic() - start
+
+    log(f"{full_host}: TRANSFER FAILURE")
+    return name, False, time.monotonic() - start
+
+def ping_all(nodes, names):
+    """Ping every named node at once; updates node_state and returns the alive names."""
+    hosts = {name: get_full_host(name, nodes[name]) for name in names}
+    # Own short-lived pool: dead nodes must not wait for transfer workers
+    with ThreadPoolExecutor(max_workers=max(len(names), 1), thread_name_prefix="ping") as ping_pool:
+        results = dict(zip(names, ping_pool.map(ping_node, [hosts[name] for name in names])))
+    alive = []
+    for name in names:
+        nodes[name]["node_state"] = "alive" if results[name] else "dead"
+        if results[name]:
+            alive.append(name)
+        else:
+            log(f"{hosts[name]}: OFFLINE")
+    return alive
+
+def transfer_round(pool, nodes, names):
+    """
+    Transfer from every named node concurrently.
+    Returns (failed names, summed per-node seconds).
+
+    Nodes are handed to the pool only while their hop has a free slot, so a
+    worker never sits waiting on a saturated relay while nodes behind other
+    hops are queued.
+    """
+    failed = []
+    busy = 0.0
+    retry = lambda n: nodes[n].get("failures", 0) > 0
+    queued = list(names)
+    running = {}  # future -> hop
+    per_hop = defaultdict(int)
+    hop_limit = MAX_PER_HOP or MAX_PARALLEL
+    while queued or running:
+        for name in list(queued):
+            if len(running) >= max(MAX_PARALLEL, 1):
+                break
+            via = nodes[name].get("via", "direct")
+            if per_hop[via] >= hop_limit:
+                continue  # relay busy; try the next node
+            queued.remove(name)
+            per_hop[via] += 1
+            running[pool.submit(transfer_node, name, nodes[name], retry(name))] = via
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+            per_hop[running.pop(future)] -= 1
+            name, ok, elapsed = future.result()
+            nodes[name]["transfer_fail"] = not ok
+            busy += elapsed
+            if not ok:
+                failed.append(name)
+    return failed, busy
+
+# ---------------------------------------------------
+# RETRY STATE MACHINE
+# ---------------------------------------------------
+def backoff_delay(failures):
+    """Exponential backoff with equal jitter: half the step fixed, half random."""
+    step = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** (failures - 1))
+    return step / 2 + random.uniform(0, step / 2)
+
+def is_due(info, now):
+    state = info.get("retry_state", "idle")
+    if state in ("idle", "probing", "transferring"):  # the latter two: interrupted run
+        return True
+    if info.get("last_error") == "offline" and info.get("last_seen", 0) > info.get("last_attempt", 0):
+        return True  # was offline, seen alive by the ping monitor since the last attempt
+    return info.get("next_attempt", 0) <= now
+
+def record_success(name, info, now):
+    if info.get("failures", 0) >= QUARANTINE_AFTER:
+        log(f"{get_full_host(name, info)}: Back from quarantine")
+    info.update(retry_state="idle", failures=0, next_attempt=0, last_success=now)
+    info.pop("last_error", None)
+
+def record_failure(name, info, error, now):
+    failures = info.get("failures", 0) + 1
+    full_host = get_full_host(name, info)
+    if failures >= QUARANTINE_AFTER:
+        delay = QUARANTINE_PROBE_SEC * random.uniform(0.9, 1.1)
+        if failures == QUARANTINE_AFTER:
+            log(f"{full_host}: QUARANTINED after {failures} failures ({error}); "
+                f"probing every {QUARANTINE_PROBE_SEC / 3600:g}h")
+        else:
+            log(f"{full_host}: still {error} (quarantined)")
+        state = "quarantined"
+    else:
+        delay = backoff_delay(failures)
+        log(f"{full_host}: {error}, failure {failures}; next attempt in {delay:.0f}s")
+        state = "backoff"
+    info.update(retry_state=state, failures=failures, next_attempt=now + delay, last_error=error)
+
+def run_pass(pool, nodes, names):
+    """Probe and transfer the named (due) nodes. Returns summed per-node seconds."""
+    now = time.time()
+    for name in names:
+        nodes[name].update(retry_state="probing", last_attempt=now)
+    alive = ping_all(nodes, names)
+    now = time.time()
+    for name in names:
+        if name not in alive:
+            nodes[name]["transfer_fail"] = True
+            record_failure(name, nodes[name], "offline", now)
+        else:
+            nodes[name]["retry_state"] = "transferring"
+    save_nodes(nodes)
+
+    failed, busy = transfer_round(pool, nodes, alive)
+    now = time.time()
+    for name in alive:
+        if name in failed:
+            record_failure(name, nodes[name], "transfer failed", now)
+        else:
+            record_success(name, nodes[name], now)
+    save_nodes(nodes)
+    return busy
+
 # ---------------------------------------------------
 # MAIN PROCESS
 # ---------------------------------------------------
+stop = threading.Event()
+
 def main():
     log("=== STARTING DATA TRANSFER: NODES TO SUPERVISOR ===")
     nodes = load_nodes()
     if not nodes:
         return
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
 
-    # STEP 1: Verify Node Health
-    for name, info in nodes.items():
-        full_host = get_full_host(name, info)
-        nodes[name]["node_state"] = "alive" if ping_node(full_host) else "dead"
-        if nodes[name]["node_state"] == "dead":
-            log(f"{full_host}: OFFLINE")
-    save_nodes(nodes)
-
-    # STEP 2: Initial Transfer Attempt
-    failed_nodes = []
-    for name, info in nodes.items():
-        full_host = get_full_host(name, info)
-
-        if info["node_state"] == "dead":
-            failed_nodes.append(name)
-            continue
-
-        if not has_remote_data(full_host):
-            log(f"{full_host}: No files found in {REMOTE_SHIP_DIR}/")
-            nodes[name]["transfer_fail"] = False
-            continue
-
-        log(f"{full_host}: Pulling data...")
-        if rsync_pull(full_host):
-            log(f"{full_host}: TRANSFER SUCCESS")
-            nodes[name]["transfer_fail"] = False
-            delete_shipping_data(full_host)
-        else:
-            log(f"{full_host}: TRANSFER FAILURE")
-            nodes[name]["transfer_fail"] = True
-            failed_nodes.append(name)
-    save_nodes(nodes)
-
-    # STEP 3: Retries for Offline or Failed Nodes
-    if failed_nodes:
-        log(f"=== RETRYING FAILED NODES (Max {MAX_RETRIES}) ===")
-        for attempt in range(1, MAX_RETRIES + 1):
-            if not failed_nodes: break
-            log(f"--- Retry Round {attempt} ---")
-            still_failing = []
-            for name in failed_nodes:
-                full_host = get_full_host(name, nodes[name])
-                if ping_node(full_host) and has_remote_data(full_host):
-                    if rsync_pull(full_host):
-                        log(f"{full_host}: SUCCESS on retry")
-                        nodes[name]["transfer_fail"] = False
-                        delete_shipping_data(full_host)
-                        continue
-                still_failing.append(name)
-            failed_nodes = still_failing
-            save_nodes(nodes)
+    run_start = time.monotonic()
+    deadline = time.time() + RUN_WINDOW_SEC
+    busy_total = 0.0
+    done = set()  # transferred successfully in this run
+    try:
+        with ThreadPoolExecutor(max_workers=max(MAX_PARALLEL, 1), thread_name_prefix="node") as pool:
+            while not stop.is_set():
+                refresh_ping_monitor(nodes)
+                now = time.time()
+                pending = [name for name in nodes if name not in done]
+                due = [name for name in pending if is_due(nodes[name], now)]
+                if due:
+                    busy_total += run_pass(pool, nodes, due)
+                    done.update(name for name in due if nodes[name]["retry_state"] == "idle")
+                    continue
+                if not pending:
+                    break
+                if now >= deadline:
+                    log(f"Run window over; {len(pending)} node(s) left to the next run")
+                    break
+                next_due = min(nodes[name].get("next_attempt", 0) for name in pending)
+                if next_due > deadline and not any(nodes[name].get("last_error") == "offline" for name in pending):
+                    log(f"Nothing due before the run window ends; {len(pending)} node(s) left to the next run")
+                    break
+                # Sleep until the next node is due, waking up to notice ping monitor updates
+                stop.wait(min(next_due - now, deadline - now, STATE_POLL_SEC))
+    finally:
+        masters.close_all()
+        save_nodes(nodes)
 
+    wall = time.monotonic() - run_start
+    log(f"Transfer time: {wall:.1f}s wall clock, {busy_total:.1f}s summed per node "
+        f"({MAX_PARALLEL} parallel, {MAX_PER_HOP or 'no'} per hop)")
+    counts = defaultdict(int)
+    for info in nodes.values():
+        counts[info.get("retry_state", "idle")] += 1
+    log("Node states: " + ", ".join(f"{n} {state}" for state, n in sorted(counts.items())))
     log("=== FINAL STATUS: COMPLETED ===")
 
 if __name__ == "__main__":
@@ -4,24 +4,45 @@ from pathlib import Path
 VENDOR_DIR = Path(__file__).resolve().parents[1] / "vendor"
 sys.path.insert(0, str(VENDOR_DIR))
 
-## Script to move all information in DATA directory to shipping directory,
-## renaming the folder with hostname and timestamp (no zipping)
+## Script to move sealed data from the DATA directory to the shipping directory,
+## into a folder named with hostname and timestamp (no zipping)
+##
+## Sensor logs and media indexes are written as time-bucketed segments (see
+## record_log.py). Only sealed segments, and the media files listed in sealed
+## media index segments, are renamed into shipping; files still being written
+## are never touched, so this can run at any time. Everything is first
+## collected in <ship_dir>.staging and the finished folder is renamed into
+## ship_dir in one step. With "rollover_sec": 0 the old behaviour (move the
+## whole data folder) is used.
+##
+## The first segmented run also ships, once, everything left over from
+## before segmented logs: legacy JSON documents (env_data.json, MASTER.json,
+## images_log.json, ...), unsegmented .jsonl logs and media that no media
+## index segment lists. Only files older than the first segment (and at
+## least LEGACY_SETTLE_SEC old) count as leftovers. When done, the run
+## leaves <base_dir>/.legacy_shipped so it never happens again.
+##
+## Every shipped file is recorded in the shipping manifest (ship_manifest.py)
+## before it appears in ship_dir, so the supervisor can pull exactly the new
+## files.
 
 import shutil
 import os
 import time
-import json
 from datetime import datetime, timezone
 
 # Determine project root dynamically (one level up from this script)
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
 
-# Load config
-config_path = "/home/pi/BEAMNode_Prototype1/scripts/node/config.json"
-with open(config_path, "r") as f:
-    config = json.load(f)
+import node_config
+from record_log import iter_frames, parse_segment, seal_segments, segment_lock, HEADER_KEY
+from media_index import INDEX_NAME
+from ship_manifest import ShipManifest, manifest_path
 
-global_cfg = config["global"]
+# Load config
+global_cfg = node_config.global_config()
+cam_cfg = node_config.section("camera")
 
 # Paths from config (with safe defaults)
 data_src = global_cfg.get("base_dir", "/home/pi/data")
@@ -43,18 +64,162 @@ dest_dir_path = os.path.join(ship_dir, dest_dir_name)
 
 start_time = time.time()
 
+# Optional near-duplicate pass over the camera images before they leave the
+# node; with "ship_duplicates": false the marked files are held back
+# in held_dir instead of being shipped.
+if cam_cfg.get("dedupe", False):
+    try:
+        sys.path.insert(0, os.path.join(project_root, "camera"))
+        import dedupe_images
+        dedupe_images.run()
+        if not cam_cfg.get("ship_duplicates", True):
+            held_dir = os.path.join(global_cfg.get("held_dir", "/home/pi/held"), cam_cfg.get("directory", "camera"))
+            os.makedirs(held_dir, exist_ok=True)
+            camera_dir = os.path.join(data_src, cam_cfg.get("directory", "camera"))
+            held = [p for p in dedupe_images.duplicate_files(camera_dir) if os.path.exists(p)]
+            for path in held:
+                shutil.move(path, os.path.join(held_dir, os.path.basename(path)))
+            print(f"Held back {len(held)} duplicate image(s) in {held_dir}")
+    except Exception as e:
+        print(f"Duplicate pass failed, shipping everything: {e}")
+
+rollover_sec = global_cfg.get("rollover_sec", 3600)
+index_stem, index_ext = os.path.splitext(INDEX_NAME)
+LEGACY_MARKER = os.path.join(data_src, ".legacy_shipped")
+LEGACY_SETTLE_SEC = 600
+LEGACY_SKIP_NAMES = {"dhash_cache.json"}  # node-local caches
+manifest = ShipManifest(manifest_path(global_cfg), ship_dir, node_id=global_cfg.get("node_id"))
+
+
+def ship_file(src, staging_dir):
+    """Rename src into the staging folder, keeping its path relative to data_src. Returns the new path."""
+    dst = os.path.join(staging_dir, os.path.relpath(src, data_src))
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.rename(src, dst)  # same filesystem: no data is copied
+    except OSError:
+        shutil.move(src, dst)
+    return dst
+
+
+def files_under(root):
+    return [os.path.join(d, f) for d, _, names in os.walk(root) for f in names]
+
+
+def register(folder, final_dir, checksums=None):
+    """Add every file in folder to the manifest under its final path in final_dir."""
+    paths = files_under(folder)
+    manifest.add(paths, checksums, [os.path.join(final_dir, os.path.relpath(p, folder)) for p in paths])
+
+
+def ship_sealed_segments(staging_dir):
+    """
+    Seal finished segments everywhere under data_src and ship them.
+    Returns {staged path: known sha256 or None}.
+    """
+    shipped = {}
+    for dirpath, dirnames, filenames in os.walk(data_src):
+        seal_segments(dirpath, rollover_sec=rollover_sec)
+        # Exclusive: no writer or compaction may touch the directory meanwhile
+        with segment_lock(dirpath, exclusive=True):
+            for name in sorted(os.listdir(dirpath)):
+                info = parse_segment(name)
+                if info is None or info[3]:
+                    continue  # not a segment, or still active
+                path = os.path.join(dirpath, name)
+                if info[0] == index_stem and info[2] == index_ext:
+                    # Media files listed in a sealed index segment are complete
+                    for entry in iter_frames(path):
+                        media = entry.get("file") if HEADER_KEY not in entry else None
+                        if (media and os.path.isfile(media)
+                                and os.path.abspath(media).startswith(os.path.abspath(data_src) + os.sep)):
+                            shipped[ship_file(media, staging_dir)] = entry.get("sha256")
+                shipped[ship_file(path, staging_dir)] = None
+    return shipped
+
+
+def ship_legacy_files(staging_dir):
+    """
+    One-time migration: ship files from before segmented logs. Returns
+    ({staged path: None}, done); done is False while it cannot yet tell
+    leftovers from captures in progress (no segment written yet).
+    """
+    buckets = []
+    indexed = set()
+    for dirpath, _, filenames in os.walk(data_src):
+        for name in filenames:
+            info = parse_segment(name)
+            if info is None:
+                continue
+            buckets.append(info[1])
+            if info[0] == index_stem and info[2] == index_ext:
+                for entry in iter_frames(os.path.join(dirpath, name)):
+                    if HEADER_KEY not in entry and entry.get("file"):
+                        indexed.add(os.path.abspath(entry["file"]))
+
+    now = time.time()
+    cutoff = min(buckets + [now - LEGACY_SETTLE_SEC])
+    shipped = {}
+    deferred = 0
+    for dirpath, _, filenames in os.walk(data_src):
+        with segment_lock(dirpath, exclusive=True):
+            for name in sorted(filenames):
+                if (name.startswith(".") or name.endswith((".lock", ".tmp", ".part"))
+                        or name in LEGACY_SKIP_NAMES or parse_segment(name) is not None):
+                    continue
+                path = os.path.join(dirpath, name)
+                if os.path.abspath(path) in indexed or not os.path.isfile(path):
+                    continue  # shipped with its index segment
+                if os.path.getmtime(path) >= cutoff:
+                    deferred += 1
+                    continue
+                shipped[ship_file(path, staging_dir)] = None
+    return shipped, bool(buckets) or not deferred
+
+
 try:
     if not os.path.exists(data_src):
         raise FileNotFoundError(f"Source data directory not found: {data_src}")
 
-    # Move the entire data folder into shipping under the new name
-    shutil.move(data_src, dest_dir_path)
-
-    # Recreate an empty data folder so the node can keep writing new data
-    os.makedirs(data_src, exist_ok=True)
+    if not rollover_sec:
+        # Move the entire data folder into shipping under the new name
+        shutil.move(data_src, dest_dir_path)
+
+        # Recreate an empty data folder so the node can keep writing new data
+        os.makedirs(data_src, exist_ok=True)
+        manifest.add(files_under(dest_dir_path))
+        print(f"Data folder moved to Shipping as {dest_dir_path}")
+    else:
+        staging_root = f"{ship_dir.rstrip(os.sep)}.staging"
+        os.makedirs(staging_root, exist_ok=True)
+        # Finish folders left behind by an interrupted run first (they may or
+        # may not have been registered; a repeated manifest entry is harmless)
+        for leftover in os.listdir(staging_root):
+            register(os.path.join(staging_root, leftover), os.path.join(ship_dir, leftover))
+            os.rename(os.path.join(staging_root, leftover), os.path.join(ship_dir, leftover))
+            print(f"Recovered interrupted shipment {leftover}")
+
+        staging_dir = os.path.join(staging_root, dest_dir_name)
+        os.makedirs(staging_dir)
+        legacy_done = os.path.exists(LEGACY_MARKER)
+        shipped = {}
+        if not legacy_done:
+            shipped, legacy_done = ship_legacy_files(staging_dir)
+            if shipped:
+                print(f"Shipping {len(shipped)} file(s) left from before segmented logs")
+        shipped.update(ship_sealed_segments(staging_dir))
+        if shipped:
+            register(staging_dir, dest_dir_path, shipped)
+            os.rename(staging_dir, dest_dir_path)
+            print(f"Shipped {len(shipped)} sealed file(s) as {dest_dir_path}")
+        else:
+            os.rmdir(staging_dir)
+            print("Nothing sealed to ship yet")
+        if legacy_done and not os.path.exists(LEGACY_MARKER):
+            with open(LEGACY_MARKER, "w") as f:
+                f.write(timestamp + "\n")
 
     total_time = time.time() - start_time
-    print(f"Data folder moved to Shipping as {dest_dir_path}")
     print(f"Total shipping time: {total_time:.2f} seconds")
 
 except Exception as e: